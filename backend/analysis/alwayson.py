@@ -4,7 +4,9 @@ from astral import LocationInfo
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from backend.services.edw import EDWApi
-from backend.core.statistics import Statistics, StatisticsRepository
+from backend.services.edw_cache import EDWSeriesCache
+from backend.core.statistics import StatisticsRepository
+from backend.database.MySQLDatabase import MySQLDatabase
 import pytz
 
 class AlwaysOn:
@@ -13,6 +15,8 @@ class AlwaysOn:
         self.fromdt = fromdt
         self.todt = todt
         self.edw_api = EDWApi()
+        self.edw_cache = EDWSeriesCache(self.edw_api)
+        self.database = MySQLDatabase.instance()
         self.statistics_repo = StatisticsRepository()
 
     def get_night_periods(self):
@@ -39,10 +43,8 @@ class AlwaysOn:
         return night_df
 
     def analyze_digital_meter(self, ts, night_periods):
-        datapoints = self.edw_api.get_datapoints(ts, self.fromdt, self.todt)
-        flat_list = [[x['start']]+ x['values'] for x in datapoints]
-        df = pd.DataFrame(flat_list, columns=["startutc"]+ts.fieldNames)
-        df["UTCTIME"] = pd.to_datetime(df["startutc"], utc=True)
+        df = self.edw_cache.get_datapoints_as_df(ts, self.fromdt, self.todt)
+        df["UTCTIME"] = df["start"]
         df["TIME"] = df["UTCTIME"].dt.tz_convert("Europe/Brussels")
         if df["injection"].sum()>0: # if we have production (assuming solar here)
             df = df.join(night_periods.set_index("timestamp"), on="UTCTIME", how="inner") # filter on non solar periods
@@ -54,33 +56,30 @@ class AlwaysOn:
         return monthly_min
 
     def store_statistics(self, ts, df):
-        stats = []
-        for index, row in df.iterrows():
-            stat = Statistics(
-                siteid="00000",
-                tsid=ts.id,
-                value=row["offtake"]*4,
-                description="Minimal Offtake (kW)",
-                calculationtime=datetime.now(),
-                fromutc=pytz.timezone("Europe/Brussels").localize(row["month_start"]).astimezone(pytz.utc),
-                toutc= pytz.timezone("Europe/Brussels").localize(row["month_start"]+pd.DateOffset(months=1)).astimezone(pytz.utc),
-                statkey="minimal/offtake",
-                eventtimeutc=None
-            )
-            stats.append(stat)
-        self.statistics_repo.bulk_upsert([s.__dict__ for s in stats])
+        month_start = pd.DatetimeIndex(df["month_start"]).tz_localize("Europe/Brussels")
+        stats = pd.DataFrame({
+            "siteid": "00000",
+            "tsid": ts.id,
+            "value": df["offtake"].to_numpy()*4,
+            "description": "Minimal Offtake (kW)",
+            "calculationtime": datetime.now(),
+            "fromutc": month_start.tz_convert("UTC"),
+            "toutc": (month_start + pd.DateOffset(months=1)).tz_convert("UTC"),
+            "statkey": "minimal/offtake",
+            "eventtimeutc": None,
+        })
+        self.statistics_repo.bulk_upsert(stats)
 
 
     def analyze(self):
-        night_periods = self.get_night_periods()
-
-        all_ts = self.edw_api.get_timeseries()
-
-        ean_ts = list(filter(lambda x: x.vaultName == "digital_meter", all_ts))
-        for each in ean_ts:
-            print(ean_ts)
-            df = self.analyze_digital_meter(ts=each, night_periods=night_periods)
-            self.store_statistics(ts=each, df=df)
+        with self.database.query_report("alwayson"):
+            night_periods = self.get_night_periods()
+
+            ean_ts = self.edw_api.find_timeseries_by_vault("digital_meter")
+            for each in ean_ts:
+                print(ean_ts)
+                df = self.analyze_digital_meter(ts=each, night_periods=night_periods)
+                self.store_statistics(ts=each, df=df)
 
 
 if __name__ == "__main__":
@@ -1,26 +1,53 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from backend.services.edw import DataPoint, TimeSeries, EDWApi
 from backend.database.MySQLDatabase import MySQLDatabase
-from backend.core.statistics import Statistics, StatisticsRepository
+from backend.core.statistics import StatisticsRepository
+from backend.core.timeseriesprice import TimeSeriesPriceRepository
+import numpy as np
 import pandas as pd
 import pytz
 
 
+@dataclass
+class TariffFormula:
+    """
+    One contract type: the quarter-hour price is taken from price_source (or its monthly average), then
+    offtake costs (offtake_scaler*price + offtake_adder)/1000 per kWh and injection earns
+    (injection_scaler*price - injection_adder)/1000 per kWh.
+    """
+    key: str
+    description: str
+    price_source: str
+    stepwise: bool = False
+    monthly_average: bool = False
+    offtake_scaler: float = 1.0
+    offtake_adder: float = 0.0
+    injection_scaler: float = 1.0
+    injection_adder: float = 0.0
+
+
+DEFAULT_TARIFFS = [
+    TariffFormula("epex", "EPEX", "Epex/BE/15"),
+    TariffFormula("average_epex", "EPEX average", "Epex/BE/15", monthly_average=True),
+    TariffFormula("endex101", "ENDEX 101", "endex/101/M", stepwise=True),
+    TariffFormula("endex103", "ENDEX 103", "endex/103/M", stepwise=True),
+]
+
+
 class ContractTypeEvaluation:
     """
     Class to evaluate the contract type based on the provided data.
     """
 
-    def __init__(self, fromdt, todt):
+    def __init__(self, fromdt, todt, tariffs=None):
         self.fromdt = fromdt
         self.todt = todt
         self.edw_api = EDWApi()
-        self.price_offtake_scaler = 1.0
-        self.price_offtake_adder = 0.0
-        self.price_injection_scaler = 1.0
-        self.price_injection_adder = 0.0
+        self.tariffs = tariffs or DEFAULT_TARIFFS
         self.database = MySQLDatabase.instance()
         self.statistics_repo = StatisticsRepository()
+        self.price_repo = TimeSeriesPriceRepository()
 
     def _get_epex_data(self, fromdt, todt):
         """
@@ -39,188 +66,80 @@ class ContractTypeEvaluation:
         return pd.DataFrame()
 
     def _get_timeseries_for_vault(self, vault_name: str):
-        timeseries = self.edw_api.get_timeseries()
-        all_ts = next(filter(lambda x: x.vaultName == vault_name, timeseries), None)
+        all_ts = next(iter(self.edw_api.find_timeseries_by_vault(vault_name)), None)
         return all_ts
 
     def _get_vault_digital_meter(self):
-        vaults = self.edw_api.get_vaults()
-        vault = next(filter(lambda x: x.name == "digital_meter", vaults), None)
-        return vault
-
-    def _get_avg_epex_sql(self, epex):
-        from_utc = int(self.fromdt.astimezone(pytz.utc).timestamp()/60)
-        to_utc = int(self.todt.astimezone(pytz.utc).timestamp()/60)
-        sql = f"""(SELECT
-                    t.utcstart,
-                  t.localstart,
-                  p.year,
-                  p.month,
-                  p.avg_monthly_price as price
-                FROM edw.ts_times t
-                LEFT JOIN (
-                  SELECT
-                    MIN(utcstart) as utcmonth,
-                    YEAR(localstart) AS year,
-                    MONTH(localstart) AS month,
-                    AVG(price) AS avg_monthly_price
-                  FROM edw.ts_prices
-                  WHERE tsid = {epex.id} 
-                  GROUP BY YEAR(localstart), MONTH(localstart)
-                ) p
-                  ON t.startmonth = p.utcmonth
-                WHERE t.utcstart>={from_utc} and t.utcstart < {to_utc}
-                ) p """
-        return sql, None
-
-    def _get_epex_sql(self, epex_ts):
-        sql = f"""ts_prices p"""
-        return sql,f" and  p.tsid = {epex_ts.id}"
-
-    def _get_endex101_sql(self, endex_ts):
-        sql = f"""ts_prices p"""
-        return sql,f" and  p.tsid = {endex_ts.id}"
-
-
-    def _get_endex103_sql(self, endex_ts):
-        sql = f"""ts_prices p"""
-        return sql,f" and  p.tsid = {endex_ts.id}"
-
-
-    def _build_digital_meter_sql(self, ts, price_sql, join_sql):
-        sql = (f"""select from_unixtime(m.utcstart * 60) as UTCTIME,m.localstart as TIME, (({self.price_offtake_scaler}*p.price+{self.price_offtake_adder})/1000)*m.offtake as OFFTAKE_COST, (({self.price_injection_scaler}*p.price - {self.price_injection_adder})/1000)*m.injection as INJECTION_PROFIT from 
-                      ts_digital_meter m join {price_sql}
-                      on m.utcstart = p.utcstart {join_sql if join_sql else ''}
-                      where m.tsid = {ts.id} and m.utcstart >= {int(self.fromdt.timestamp() / 60)} and m.utcstart < {int(self.todt.timestamp() / 60)}
-                      order by m.utcstart""")
-        return sql
+        return self.edw_api.find_vault("digital_meter")
 
-    def analyze_digital_meter(self, ts, endex101, endex103, epex):
-
-        epex_sql, join_epex_sql = self._get_epex_sql(epex)
-        avg_epex_sql, join_avg_epex_sql = self._get_avg_epex_sql(epex)
-        endex101_sql, join_endex101_sql = self._get_endex101_sql(endex101)
-        endex103_sql, join_endex103_sql = self._get_endex103_sql(endex103)
+    def _build_digital_meter_sql(self, ts):
+        sql = (f"""select m.utcstart, m.offtake, m.injection from ts_digital_meter m
+                      where m.tsid = {ts.id} and m.utcstart >= {int(self.fromdt.timestamp() / 60)} and m.utcstart < {int(self.todt.timestamp() / 60)}""")
+        return sql
 
-        df_epex = self.database.query(sql=self._build_digital_meter_sql(ts, epex_sql, join_epex_sql), timecols=['utcstart'])
-        df_avg_epex = self.database.query(sql=self._build_digital_meter_sql(ts, avg_epex_sql, join_avg_epex_sql), timecols=['utcstart'])
-        df_endex101 = self.database.query(sql=self._build_digital_meter_sql(ts, endex101_sql, join_endex101_sql), timecols=['utcstart'])
-        df_endex103 = self.database.query(sql=self._build_digital_meter_sql(ts, endex103_sql, join_endex103_sql), timecols=['utcstart'])
+    def _tariff_prices(self, price_ts, utcstarts):
+        """Price matrix, one row per tariff, for the given quarter-hours. NaN where a tariff has no price."""
+        prices = np.empty((len(self.tariffs), len(utcstarts)))
+        for i, tariff in enumerate(self.tariffs):
+            tsid = price_ts[tariff.price_source].id
+            if tariff.monthly_average:
+                prices[i] = self.price_repo.monthly_average_at(tsid, utcstarts)
+            else:
+                prices[i] = self.price_repo.prices_at(tsid, utcstarts, tariff.stepwise)
+        return prices
+
+    def evaluate(self, ts, price_ts):
+        """
+        Offtake cost and injection profit of one meter under every tariff, in one pass over the meter's
+        quarter-hours. Quarter-hours without a price for a tariff do not count for that tariff.
+        """
+        offtake_scaler = np.array([t.offtake_scaler for t in self.tariffs])[:, None]
+        offtake_adder = np.array([t.offtake_adder for t in self.tariffs])[:, None]
+        injection_scaler = np.array([t.injection_scaler for t in self.tariffs])[:, None]
+        injection_adder = np.array([t.injection_adder for t in self.tariffs])[:, None]
+        offtake_cost = np.zeros(len(self.tariffs))
+        injection_profit = np.zeros(len(self.tariffs))
+        for chunk in self.database.query_iter(self._build_digital_meter_sql(ts), as_numpy=True):
+            prices = self._tariff_prices(price_ts, chunk['utcstart'].astype(np.int64))
+            offtake = chunk['offtake'].astype(np.float64)
+            injection = chunk['injection'].astype(np.float64)
+            offtake_cost += np.nansum((offtake_scaler * prices + offtake_adder) / 1000 * offtake, axis=1)
+            injection_profit += np.nansum((injection_scaler * prices - injection_adder) / 1000 * injection, axis=1)
+        return pd.DataFrame({'OFFTAKE_COST': offtake_cost, 'INJECTION_PROFIT': injection_profit},
+                            index=[t.key for t in self.tariffs])
+
+    def analyze_digital_meter(self, ts, price_ts):
+        totals = self.evaluate(ts, price_ts)
 
         now = datetime.utcnow()
-        stats_to_insert = [
-            Statistics(
-                siteid='00000',
-                tsid=ts.id,
-                statkey='offtake/cost/epex',
-                value=df_epex['OFFTAKE_COST'].sum(),
-                description='Offtake cost according to EPEX',
-                calculationtime=now,
-                fromutc=self.fromdt,
-                toutc=self.todt,
-                eventtimeutc=None
-            ),
-            Statistics(
-                siteid='00000',
-                tsid=ts.id,
-                statkey='offtake/cost/average_epex',
-                value=df_avg_epex['OFFTAKE_COST'].sum(),
-                description='Offtake cost according to EPEX average',
-                calculationtime=now,
-                fromutc=self.fromdt,
-                toutc=self.todt,
-                eventtimeutc=None
-            ),
-            Statistics(
-                siteid='00000',
-                tsid=ts.id,
-                statkey='offtake/cost/endex101',
-                value=df_endex101['OFFTAKE_COST'].sum(),
-                description='Offtake cost according to ENDEX 101',
-                calculationtime=now,
-                fromutc=self.fromdt,
-                toutc=self.todt,
-                eventtimeutc=None
-
-            ),
-            Statistics(
-                siteid='00000',
-                tsid=ts.id,
-                statkey='offtake/cost/endex103',
-                value=df_endex103['OFFTAKE_COST'].sum(),
-                description='Offtake cost according to ENDEX 103',
-                calculationtime=now,
-                fromutc=self.fromdt,
-                toutc=self.todt,
-                eventtimeutc=None
-            ),
-            # Injection profit stats
-            Statistics(
-                siteid='00000',
-                tsid=ts.id,
-                statkey='injection/profit/epex',
-                value=df_epex['INJECTION_PROFIT'].sum(),
-                description='Injection profit according to EPEX',
-                calculationtime=now,
-                fromutc=self.fromdt,
-                toutc=self.todt,
-                eventtimeutc=None
-            ),
-            Statistics(
-                siteid='00000',
-                tsid=ts.id,
-                statkey='injection/profit/average_epex',
-                value=df_avg_epex['INJECTION_PROFIT'].sum(),
-                description='Injection profit according to EPEX average',
-                calculationtime=now,
-                fromutc=self.fromdt,
-                toutc=self.todt,
-                eventtimeutc=None
-            ),
-            Statistics(
-                siteid='00000',
-                tsid=ts.id,
-                statkey='injection/profit/endex101',
-                value=df_endex101['INJECTION_PROFIT'].sum(),
-                description='Injection profit according to ENDEX 101',
-                calculationtime=now,
-                fromutc=self.fromdt,
-                toutc=self.todt,
-                eventtimeutc=None
-            ),
-            Statistics(
-                siteid='00000',
-                tsid=ts.id,
-                statkey='injection/profit/endex103',
-                value=df_endex103['INJECTION_PROFIT'].sum(),
-                description='Injection profit according to ENDEX 103',
-                calculationtime=now,
-                fromutc=self.fromdt,
-                toutc=self.todt,
-                eventtimeutc=None
-            )
-        ]
+        stats_to_insert = pd.DataFrame({
+            'siteid': '00000',
+            'tsid': ts.id,
+            'statkey': [f'offtake/cost/{t.key}' for t in self.tariffs] + [f'injection/profit/{t.key}' for t in self.tariffs],
+            'value': np.concatenate([totals['OFFTAKE_COST'].to_numpy(), totals['INJECTION_PROFIT'].to_numpy()]),
+            'description': [f'Offtake cost according to {t.description}' for t in self.tariffs]
+                           + [f'Injection profit according to {t.description}' for t in self.tariffs],
+            'calculationtime': now,
+            'fromutc': self.fromdt,
+            'toutc': self.todt,
+            'eventtimeutc': None,
+        })
 
         # Bulk upsert them to the DB
-        self.statistics_repo.bulk_upsert([s.__dict__ for s in stats_to_insert])
-
-
-
+        self.statistics_repo.bulk_upsert(stats_to_insert)
 
     def analyze(self):
-        from_utc = int(self.fromdt.astimezone(pytz.utc).timestamp()/60)
-        to_utc = int(self.todt.astimezone(pytz.utc).timestamp()/60)
-
-        all_ts = self.edw_api.get_timeseries()
-
-        endex101 = next(filter(lambda x: x.name == "endex/101/15", all_ts), None)
-        endex103 = next(filter(lambda x: x.name == "endex/103/15", all_ts), None)
-        epex15 = next(filter(lambda x: x.name == "Epex/BE/15", all_ts), None)
-
-        ean_ts = list(filter(lambda x: x.vaultName == "digital_meter", all_ts))
-        for each in ean_ts:
-            print(ean_ts)
-            self.analyze_digital_meter(ts=each, endex101=endex101, endex103=endex103, epex=epex15)
+        with self.database.query_report("contracttype"):
+            price_ts = {}
+            for source in {t.price_source for t in self.tariffs}:
+                price_ts[source] = self.edw_api.find_timeseries(source)
+                if not price_ts[source]:
+                    raise Exception(f"Price timeseries {source} not found.")
+
+            ean_ts = self.edw_api.find_timeseries_by_vault("digital_meter")
+            for each in ean_ts:
+                print(ean_ts)
+                self.analyze_digital_meter(ts=each, price_ts=price_ts)
 
 
 if __name__ == "__main__":
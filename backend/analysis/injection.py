@@ -1,7 +1,8 @@
 from datetime import datetime
 import pandas as pd
 import pytz
-from backend.core.statistics import Statistics, StatisticsRepository
+from backend.core.statistics import StatisticsRepository
+from backend.core.timeseriesprice import TimeSeriesPriceRepository
 from datetime import datetime, timedelta
 from backend.services.edw import EDWApi
 from backend.database.MySQLDatabase import MySQLDatabase
@@ -17,117 +18,98 @@ class InjectionAnalysis:
         self.edw_api = EDWApi()
         self.database = MySQLDatabase.instance()
         self.statistics_repo = StatisticsRepository()
+        self.price_repo = TimeSeriesPriceRepository()
 
     def _get_timeseries(self):
-        all_ts = self.edw_api.get_timeseries()
-        epex = next(filter(lambda x: x.name == "Epex/BE/15", all_ts), None)
-        digital_meters = list(filter(lambda x: x.vaultName == "digital_meter", all_ts))
+        epex = self.edw_api.find_timeseries("Epex/BE/15")
+        digital_meters = self.edw_api.find_timeseries_by_vault("digital_meter")
         return digital_meters, epex
 
-    def _build_query(self, ts, price_ts):
+    def _build_query(self, ts):
         sql = f"""
         SELECT 
-            from_unixtime(m.utcstart * 60) AS timestamp,
-            m.injection,
-            p.price
+            m.utcstart,
+            m.injection
         FROM 
             ts_digital_meter m
-        JOIN 
-            ts_prices p ON m.utcstart = p.utcstart
         WHERE 
             m.tsid = {ts.id}
-            AND p.tsid = {price_ts.id}
             AND m.utcstart >= {int(self.fromdt.timestamp() / 60)}
             AND m.utcstart < {int(self.todt.timestamp() / 60)}
         ORDER BY m.utcstart
         """
         return sql
 
+    def _summarize(self, sql, price_curve):
+        """Fold the monthly positive/negative priced injection over the streamed query result."""
+        summary = pd.DataFrame(columns=['positive_injection', 'negative_injection'], dtype='float64')
+        for df in self.database.query_iter(sql):
+            # quarters without a price count as neither, as the former join on ts_prices dropped them
+            price = pd.Series(price_curve.prices_at(df['utcstart'].to_numpy()), index=df.index)
+            # Convert UTC to Europe/Brussels
+            timestamps = pd.to_datetime(df['utcstart'] * 60, unit='s', utc=True).dt.tz_convert('Europe/Brussels')
+            chunk = pd.DataFrame({
+                'month': timestamps.dt.tz_localize(None).dt.to_period('M'),
+                'positive_injection': df['injection'].where(price >= 0, 0),
+                'negative_injection': df['injection'].where(price < 0, 0),
+            }).groupby('month').sum()
+            # a month can span two chunks
+            summary = chunk if summary.empty else summary.add(chunk, fill_value=0)
+        return summary
+
     def analyze(self, persist=True):
-        digital_meters, price_ts = self._get_timeseries()
-        for ts in digital_meters:
-            if not ts or not price_ts:
+        with self.database.query_report("injection"):
+            digital_meters, price_ts = self._get_timeseries()
+            if not price_ts:
                 raise Exception("Required timeseries not found.")
+            # loaded once, shared by every meter
+            price_curve = self.price_repo.get_price_curve(price_ts.id)
+            for ts in digital_meters:
+                if not ts:
+                    raise Exception("Required timeseries not found.")
 
-            sql = self._build_query(ts, price_ts)
-            df = self.database.query(sql=sql, timecols=['timestamp'])
-
-            if df.empty:
-                print("No data found for the selected period.")
-                return pd.DataFrame()
+                sql = self._build_query(ts)
+                summary = self._summarize(sql, price_curve)
 
-            # Convert UTC to Europe/Brussels
-            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True).dt.tz_convert('Europe/Brussels')
-            df.set_index('timestamp', inplace=True)
-            df['month'] = df.index.to_period('M')
-
-            df['positive_injection'] = df.apply(lambda x: x['injection'] if x['price'] >= 0 else 0, axis=1)
-            df['negative_injection'] = df.apply(lambda x: x['injection'] if x['price'] < 0 else 0, axis=1)
+                if summary.empty:
+                    print("No data found for the selected period.")
+                    return pd.DataFrame()
 
-            summary = df.groupby('month')[['positive_injection', 'negative_injection']].sum()
-            summary['total_injection'] = summary['positive_injection'] + summary['negative_injection']
-            summary['neg_price_pct'] = (summary['negative_injection'] / summary['total_injection']) * 100
-            summary.fillna(0, inplace=True)
-            if persist:
-                self._persist_statistics(summary, ts.id)
+                summary['total_injection'] = summary['positive_injection'] + summary['negative_injection']
+                summary['neg_price_pct'] = (summary['negative_injection'] / summary['total_injection']) * 100
+                summary.fillna(0, inplace=True)
+                if persist:
+                    self._persist_statistics(summary, ts.id)
 
 
     def _persist_statistics(self, summary_df: pd.DataFrame, tsid: int):
-        import pytz
-        from pandas import Timestamp
-
         now = datetime.utcnow()
-        brussels_tz = pytz.timezone("Europe/Brussels")
-        stats_to_insert = []
-
-        for period, row in summary_df.iterrows():
-            # Convert Period to timestamp in Brussels time
-            month_start_local = period.to_timestamp().tz_localize(brussels_tz)
-            month_end_local = (period + 1).to_timestamp().tz_localize(brussels_tz)
-
-            # Convert to UTC for DB storage
-            fromutc = month_start_local.astimezone(pytz.UTC)
-            toutc = month_end_local.astimezone(pytz.UTC)
-
-
-            stats_to_insert.extend([
-                Statistics(
-                    siteid="00000",
-                    tsid=tsid,
-                    statkey='injection/pos_priced',
-                    value=row['positive_injection'],
-                    description='Injected kWh with positive price',
-                    calculationtime=now,
-                    fromutc=fromutc,
-                    toutc=toutc,
-                    eventtimeutc=None
-                ),
-                Statistics(
-                    siteid="00000",
-                    tsid=tsid,
-                    statkey='injection/neg_priced',
-                    value=row['negative_injection'],
-                    description='Injected kWh with negative price',
-                    calculationtime=now,
-                    fromutc=fromutc,
-                    toutc=toutc,
-                    eventtimeutc=None
-                ),
-                Statistics(
-                    siteid="00000",
-                    tsid=tsid,
-                    statkey='injection/neg_price_pct',
-                    value=row['neg_price_pct'],
-                    description='Percentage of injected kWh at negative price',
-                    calculationtime=now,
-                    fromutc=fromutc,
-                    toutc=toutc,
-                    eventtimeutc=None
-                )
-            ])
-
-        self.statistics_repo.bulk_upsert([s.__dict__ for s in stats_to_insert])
-        print(f"✅ Persisted {len(stats_to_insert)} injection statistics.")
+        months = summary_df.index
+        # Month boundaries in Brussels time, converted to UTC for DB storage
+        fromutc = months.to_timestamp().tz_localize("Europe/Brussels").tz_convert("UTC")
+        toutc = (months + 1).to_timestamp().tz_localize("Europe/Brussels").tz_convert("UTC")
+
+        stats_to_insert = pd.concat([
+            pd.DataFrame({
+                'siteid': "00000",
+                'tsid': tsid,
+                'statkey': statkey,
+                'value': summary_df[col].to_numpy(),
+                'description': description,
+                'calculationtime': now,
+                'fromutc': fromutc,
+                'toutc': toutc,
+                'eventtimeutc': None,
+            })
+            for col, statkey, description in [
+                ('positive_injection', 'injection/pos_priced', 'Injected kWh with positive price'),
+                ('negative_injection', 'injection/neg_priced', 'Injected kWh with negative price'),
+                ('neg_price_pct', 'injection/neg_price_pct', 'Percentage of injected kWh at negative price'),
+            ]
+        ], ignore_index=True)
+
+        result = self.statistics_repo.bulk_upsert(stats_to_insert)
+        print(f"✅ Persisted {result['rows']} injection statistics ({result['inserted']} inserted, {result['updated']} updated).")
 
 if __name__ == "__main__":
 
@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta
 from backend.services.edw import DataPoint, TimeSeries, EDWApi
 from backend.database.MySQLDatabase import MySQLDatabase
-from backend.core.statistics import Statistics, StatisticsRepository
+from backend.core.statistics import StatisticsRepository
 import pandas as pd
 import pytz
 
@@ -54,26 +54,25 @@ class PeakAnalysis:
         return df
 
     def store_peak_statistics(self, df):
-        stats = []
-        for index, row in df.iterrows():
-            stat = Statistics(
-                siteid="00000",
-                tsid=row["tsid"],
-                value=row["peak_offtake"],
-                description="Peak Offtake (kW)",
-                calculationtime=datetime.now(),
-                fromutc=pytz.timezone("Europe/Brussels").localize(row["month"]).astimezone(pytz.utc),
-                toutc= pytz.timezone("Europe/Brussels").localize(row["month"]+pd.DateOffset(months=1)).astimezone(pytz.utc),
-                statkey="peak/offtake",
-                eventtimeutc=row["peak_timestamp"],
-            )
-            stats.append(stat)
-        self.statistics_repo.bulk_upsert([s.__dict__ for s in stats])
+        month = pd.DatetimeIndex(df["month"]).tz_localize("Europe/Brussels")
+        stats = pd.DataFrame({
+            "siteid": "00000",
+            "tsid": df["tsid"].to_numpy(),
+            "value": df["peak_offtake"].to_numpy(),
+            "description": "Peak Offtake (kW)",
+            "calculationtime": datetime.now(),
+            "fromutc": month.tz_convert("UTC"),
+            "toutc": (month + pd.DateOffset(months=1)).tz_convert("UTC"),
+            "statkey": "peak/offtake",
+            "eventtimeutc": df["peak_timestamp"].to_numpy(),
+        })
+        self.statistics_repo.bulk_upsert(stats)
 
     def analyze(self):
-        # Implement visualization logic
-        df = self.analyze_peaks()
-        self.store_peak_statistics(df)
+        with self.database.query_report("peaks"):
+            # Implement visualization logic
+            df = self.analyze_peaks()
+            self.store_peak_statistics(df)
 
 if __name__ == "__main__":
 
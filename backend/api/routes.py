@@ -9,4 +9,9 @@ def api_ping_db():
     result = MySQLDatabase.instance().query("SELECT 1")
     result = result.iloc[0, 0]
     return "pong " + str(result)
+
+
+@router.get("/api/pool")
+def api_pool_status():
+    return MySQLDatabase.instance().pool_status()
     
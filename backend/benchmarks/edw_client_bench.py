@@ -0,0 +1,116 @@
+"""
+Throughput benchmark of the EDW client paths against the in-process FakeEDWServer.
+
+    python -m backend.benchmarks.edw_client_bench --series 1000 --days 365 --fields 2
+    python -m backend.benchmarks.edw_client_bench --series 20 --days 30 --latency 0.02
+
+Every scenario reports calls, points/s, p50/p99 latency per call and the peak Python heap of
+a single call (traced separately, tracemalloc would skew the timings) so regressions in the
+ingestion hot paths show up before production.
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from backend.benchmarks.fake_edw import FakeEDWServer
+from backend.services.edw import EDWApi
+from backend.services.edw_async import AsyncEDWApi
+
+
+def _report(name, latencies, points, elapsed, peak):
+    latencies = np.array(latencies) * 1000
+    print(f"{name:<24} calls={len(latencies):>6} points/s={points / elapsed:>12,.0f} "
+          f"p50={np.percentile(latencies, 50):>8.1f}ms p99={np.percentile(latencies, 99):>8.1f}ms "
+          f"peak_mem/call={peak / 1024 ** 2:>8.1f}MB total={elapsed:>7.2f}s")
+
+
+def _peak_memory(call):
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def _measure(name, calls, workers):
+    """Run the callables on `workers` threads; each returns the number of points it moved."""
+    def timed(call):
+        start = time.perf_counter()
+        points = call()
+        return time.perf_counter() - start, points
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(timed, calls))
+    elapsed = time.perf_counter() - start
+    _report(name, [r[0] for r in results], sum(r[1] for r in results), elapsed, _peak_memory(calls[0]))
+
+
+def bench_reads(api, series, fromdt, todt, workers):
+    _measure("read json", [lambda ts=ts: len(api.get_datapoints(ts, fromdt, todt)) for ts in series], workers)
+    _measure("read arrays", [lambda ts=ts: len(api.get_datapoints_as_arrays(ts, fromdt, todt)[0]) for ts in series], workers)
+    _measure("read df", [lambda ts=ts: len(api.get_datapoints_as_df(ts, fromdt, todt)) for ts in series], workers)
+    _measure("read df float32", [lambda ts=ts: len(api.get_datapoints_as_df(ts, fromdt, todt, dtype=np.float32)) for ts in series], workers)
+
+
+def bench_async_reads(url, series, fromdt, todt, concurrency):
+    async def run(series):
+        async with AsyncEDWApi(base_url=url, concurrency=concurrency) as api:
+            async def timed(ts):
+                start = time.perf_counter()
+                df = await api.get_datapoints_as_df(ts, fromdt, todt)
+                return time.perf_counter() - start, len(df)
+            return await asyncio.gather(*[timed(ts) for ts in series])
+
+    start = time.perf_counter()
+    results = asyncio.run(run(series))
+    elapsed = time.perf_counter() - start
+    _report("async read df", [r[0] for r in results], sum(r[1] for r in results), elapsed,
+            _peak_memory(lambda: asyncio.run(run(series[:1]))))
+
+
+def bench_writes(api, series, fromdt, todt, fields, workers):
+    times = pd.date_range(fromdt, todt, freq="15min", inclusive="left")
+    df = pd.DataFrame(np.random.default_rng(0).random((len(times), len(fields))), columns=fields)
+    df.insert(0, "UTCTIME", times)
+
+    def store(ts, compress):
+        results = api.store_dataframe(ts.id, df, time_col="UTCTIME", val_cols=fields, compress=compress)
+        return sum(r.rows for r in results if r.ok)
+
+    _measure("write dataframe", [lambda ts=ts: store(ts, False) for ts in series], workers)
+    _measure("write dataframe gzip", [lambda ts=ts: store(ts, True) for ts in series], workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--series", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--fields", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.0, help="added server latency per request (s)")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent series (threads / async concurrency)")
+    parser.add_argument("--skip-writes", action="store_true")
+    args = parser.parse_args()
+
+    todt = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    fromdt = todt - timedelta(days=args.days)
+    print(f"{args.series} series x {args.days} days x 15min x {args.fields} fields, latency {args.latency}s, {args.workers} workers")
+
+    with FakeEDWServer(series=args.series, fields=args.fields, latency=args.latency) as server:
+        api = EDWApi(base_url=server.url, pool_size=args.workers)
+        series = api.get_timeseries()
+        fields = series[0].fieldNames
+        bench_reads(api, series, fromdt, todt, args.workers)
+        bench_async_reads(server.url, series, fromdt, todt, args.workers)
+        if not args.skip_writes:
+            bench_writes(api, series, fromdt, todt, fields, args.workers)
+        print(f"server handled {server.requests} requests, {server.points_written} points written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import gzip
+import json
+import re
+import threading
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+VALUES_PATH = re.compile(r"^/timeseries/(\d+)/values$")
+
+
+class FakeEDWServer:
+    """
+    In-process stand-in for the EDW REST API, for load tests and benchmarks.
+
+    Implements /timeseries, /vaults, /recordspecs and /timeseries/{id}/values. Reads return
+    synthetic 15-minute data for any window; writes are decoded (gzip aware) and counted.
+    `latency` (seconds) is added to every request and `fields` sets the width of every record.
+
+    usage:
+        with FakeEDWServer(series=1000, fields=9, latency=0.01) as server:
+            api = EDWApi(base_url=server.url)
+    """
+
+    def __init__(self, series=10, fields=9, latency=0.0, vault="digital_meter", last_time=None):
+        self.latency = latency
+        self.fields = [f"field{i}" for i in range(fields)]
+        self.vaults = [{
+            "id": 1,
+            "name": vault,
+            "partitioned": False,
+            "active": True,
+            "maxTime": None,
+            "recordSpec": {
+                "id": 1,
+                "name": vault,
+                "fieldSpecs": [{"name": x, "type": "DECIMAL", "precision": 9, "scale": 3, "unit": ""} for x in self.fields],
+            },
+        }]
+        last_time = (last_time or datetime.now(timezone.utc)).isoformat()
+        self.timeseries = [self._timeseries_json(i, f"bench/{i}", vault, last_time) for i in range(1, series + 1)]
+        self.points_written = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _timeseries_json(self, ts_id, name, vault_name, last_time=None):
+        vault = next((v for v in self.vaults if v["name"] == vault_name), self.vaults[0])
+        return {
+            "id": ts_id,
+            "name": name,
+            "firstTime": None,
+            "lastTime": last_time,
+            "period": "PT15M",
+            "createdAt": "2024-01-01T00:00:00",
+            "modifiedAt": "2024-01-01T00:00:00",
+            "vault": vault,
+        }
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @lru_cache(maxsize=64)
+    def values_body(self, from_str, to_str) -> bytes:
+        """Synthetic response for a window; identical for every series so it is generated once."""
+        starts = pd.date_range(pd.Timestamp(from_str).tz_convert("UTC"), pd.Timestamp(to_str).tz_convert("UTC"),
+                               freq="15min", inclusive="left")
+        values = np.round(np.random.default_rng(len(starts)).random((len(starts), len(self.fields))) * 100, 3).tolist()
+        starts = np.datetime_as_string(starts.tz_localize(None).values.astype("datetime64[s]"), unit="s", timezone="UTC").tolist()
+        return json.dumps([{"start": s, "values": v} for s, v in zip(starts, values)]).encode("utf-8")
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, body, status=200):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                return json.loads(body)
+
+            def _begin(self):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                return urlparse(self.path), parse_qs(urlparse(self.path).query)
+
+            def do_GET(self):
+                url, query = self._begin()
+                if url.path == "/timeseries":
+                    names = query.get("name")
+                    self._send([ts for ts in server.timeseries if not names or ts["name"] in names])
+                elif url.path == "/vaults":
+                    self._send(server.vaults)
+                elif VALUES_PATH.match(url.path):
+                    self._send(server.values_body(query["from"][0], query["to"][0]))
+                else:
+                    self._send({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                url, _ = self._begin()
+                data = self._read_json()
+                if url.path == "/timeseries":
+                    with server._lock:
+                        ts = server._timeseries_json(len(server.timeseries) + 1, data["name"], data["vault"]["name"])
+                        server.timeseries.append(ts)
+                    self._send(ts)
+                elif url.path == "/vaults":
+                    vault = dict(server.vaults[0], id=len(server.vaults) + 1, name=data["name"])
+                    server.vaults.append(vault)
+                    self._send(vault)
+                elif url.path == "/recordspecs":
+                    self._send({"id": 1, "name": data["name"], "fieldSpecs": data["fieldSpecs"]})
+                elif VALUES_PATH.match(url.path):
+                    with server._lock:
+                        server.points_written += len(data)
+                    self._send({"count": len(data)})
+                else:
+                    self._send({"error": "not found"}, status=404)
+
+        return Handler
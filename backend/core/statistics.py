@@ -1,8 +1,9 @@
 from backend.core.repository import Repository
-from sqlalchemy import Column, BigInteger, String, Integer, DECIMAL, DateTime, ForeignKey
+from sqlalchemy import Column, BigInteger, String, Integer, DECIMAL, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import text
+import numpy as np
 import pandas as pd
 
 
@@ -10,8 +11,12 @@ import pandas as pd
 Base = declarative_base()
 
 class Statistics(Base):
-    __tablename__ = 'nett.statistics'
-    __table_args__ = {'schema': 'nett'}
+    __tablename__ = 'statistics'
+    __table_args__ = (
+        # backs find_many, see database/migrations/001_statistics_tsid_statkey_fromutc.sql
+        Index('ix_statistics_tsid_statkey_fromutc', 'tsid', 'statkey', 'fromutc'),
+        {'schema': 'nett'},
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     siteid = Column(String(100), nullable=True)
@@ -36,10 +41,10 @@ class StatisticsRepository(Repository):
         with self.new_session() as session:
             return session.query(Statistics).filter(Statistics.tsid == tsid).all()
 
-    def find_by_timeseries(self, siteid: str):
-        """Fetch all statistics records as a list of Statistics objects."""
+    def find_by_site(self, siteid: str):
+        """Fetch all statistics records of a site as a list of Statistics objects."""
         with self.new_session() as session:
-            return session.query(Statistics).filter(Statistics.tsid == siteid).all()
+            return session.query(Statistics).filter(Statistics.siteid == siteid).all()
 
 
     def find_between(self, tsid, start_time, end_time):
@@ -61,23 +66,99 @@ class StatisticsRepository(Repository):
             )
             return pd.read_sql_query(query.statement, session.bind)
 
-    def bulk_upsert(self, data):
-        """Bulk insert or update statistics records."""
+    def find_many(self, tsids=None, siteids=None, statkeys=None, start_time=None, end_time=None, pivot=True):
+        """
+        Fetch the statistics of many timeseries, sites and statkeys over [start_time, end_time) in one
+        query; a None filter matches everything. With pivot, returns one row per (siteid, tsid, fromutc,
+        toutc), NULL keys included, and one float column per statkey, otherwise the long format.
+        """
         with self.new_session() as session:
-            val = session.execute(
-                text("""
-                INSERT INTO nett.statistics (siteid, tsid, value, description, calculationtime, fromutc, toutc, statkey, eventtimeutc)
-                VALUES (:siteid, :tsid, :value, :description, :calculationtime, :fromutc, :toutc, :statkey, :eventtimeutc)
-                ON DUPLICATE KEY UPDATE
-                    value = VALUES(value),
-                    description = VALUES(description),
-                    calculationtime = VALUES(calculationtime),
-                    fromutc = VALUES(fromutc),
-                    toutc = VALUES(toutc),
-                    eventtimeutc = VALUES(eventtimeutc)
-                """),
-                data
+            query = session.query(
+                Statistics.siteid, Statistics.tsid, Statistics.fromutc, Statistics.toutc, Statistics.statkey,
+                Statistics.value
             )
-            print(val.rowcount)
+            if tsids is not None:
+                query = query.filter(Statistics.tsid.in_(list(tsids)))
+            if siteids is not None:
+                query = query.filter(Statistics.siteid.in_(list(siteids)))
+            if statkeys is not None:
+                query = query.filter(Statistics.statkey.in_(list(statkeys)))
+            if start_time is not None:
+                query = query.filter(Statistics.fromutc >= start_time)
+            if end_time is not None:
+                query = query.filter(Statistics.toutc <= end_time)
+            df = pd.read_sql_query(query.statement, session.bind)
+        df["value"] = df["value"].astype(np.float64)
+        if not pivot:
+            return df
+        keys = ["siteid", "tsid", "fromutc", "toutc"]
+        if df.empty:
+            statkeys = list(statkeys or [])
+            return pd.DataFrame(columns=keys + statkeys).astype({key: np.float64 for key in statkeys})
+        # groupby with dropna=False keeps the rows whose siteid or tsid is NULL, pivot_table drops them
+        wide = df.groupby(keys + ["statkey"], dropna=False)["value"].last().unstack("statkey")
+        wide.columns.name = None
+        return wide.reset_index()
+
+    def bulk_upsert(self, data, batch_size: int = 1000):
+        """
+        Bulk insert or update statistics records from a DataFrame, a dict of column arrays or a list of
+        row dicts (ORM instance state is ignored). Rows are sent as multi-row upserts of batch_size rows,
+        all in one transaction. Returns {"rows", "inserted", "updated"}; with MySQL's found-rows
+        counting an updated row counts 2, so updated = rowcount - rows (unchanged rows count as inserted).
+        """
+        df = _statistics_frame(data)
+        if df.empty:
+            return {"rows": 0, "inserted": 0, "updated": 0}
+        values = df.to_numpy(dtype=object)
+        rowcount = 0
+        with self.new_session() as session:
+            connection = session.connection()
+            for offset in range(0, len(values), batch_size):
+                batch = values[offset:offset + batch_size]
+                row = "(" + ",".join(["%s"] * len(STATISTICS_COLUMNS)) + ")"
+                result = connection.exec_driver_sql(
+                    f"""
+                    INSERT INTO nett.statistics ({', '.join(STATISTICS_COLUMNS)})
+                    VALUES {','.join([row] * len(batch))}
+                    ON DUPLICATE KEY UPDATE
+                        value = VALUES(value),
+                        description = VALUES(description),
+                        calculationtime = VALUES(calculationtime),
+                        fromutc = VALUES(fromutc),
+                        toutc = VALUES(toutc),
+                        eventtimeutc = VALUES(eventtimeutc)
+                    """,
+                    tuple(_sql_value(v) for v in batch.ravel())
+                )
+                rowcount += result.rowcount
             session.commit()
-            return len(data)
+        updated = min(max(rowcount - len(df), 0), len(df))
+        return {"rows": len(df), "inserted": len(df) - updated, "updated": updated}
+
+
+STATISTICS_COLUMNS = ["siteid", "tsid", "value", "description", "calculationtime", "fromutc", "toutc", "statkey",
+                      "eventtimeutc"]
+
+
+def _sql_value(value):
+    """numpy/pandas scalars as the plain Python values the driver knows how to escape."""
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _statistics_frame(data) -> pd.DataFrame:
+    """Statistics rows as a frame with STATISTICS_COLUMNS, naive UTC datetimes and None for missing values."""
+    df = pd.DataFrame(data)
+    for col in STATISTICS_COLUMNS:
+        if col not in df:
+            df[col] = None
+    df = df[STATISTICS_COLUMNS].copy()
+    for col in ["calculationtime", "fromutc", "toutc", "eventtimeutc"]:
+        if df[col].notna().any():
+            times = pd.to_datetime(df[col], utc=True)
+            df[col] = times.dt.tz_localize(None).astype(object).where(times.notna(), None)
+    return df.astype(object).where(df.notna(), None)
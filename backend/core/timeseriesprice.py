@@ -1,3 +1,10 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
 import pandas as pd
 from sqlalchemy import Column, Integer, DECIMAL, TIMESTAMP, DATETIME, Computed
 from sqlalchemy.ext.declarative import declarative_base
@@ -23,6 +30,137 @@ class TimeSeriesPrice(Base):
 
 
 
+def expand_prices(utcstarts: np.ndarray, prices: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """Vectorized as-of lookup: the price in effect at every grid minute, NaN before the first price."""
+    pos = np.searchsorted(utcstarts, grid, side="right") - 1
+    return np.where(pos >= 0, prices[np.maximum(pos, 0)] if len(prices) else np.nan, np.nan)
+
+
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", default="300"))  # seconds between incremental refreshes
+PRICE_CACHE_FOLDER = os.getenv("PRICE_CACHE_FOLDER")  # when set, price curves are memory-mapped from here
+
+
+class PriceCurve:
+    """
+    One ts_prices series as a dense numpy array on a regular `step`-minute grid: values[i] is the
+    price at utcstart origin + i*step, NaN where there is no price. Step-wise curves (e.g. the monthly
+    Endex quotations) keep their knots and are forward-filled up to the end of the last local month.
+    """
+
+    def __init__(self, tsid, step=15, stepwise=False):
+        self.tsid = tsid
+        self.step = step
+        self.stepwise = stepwise
+        self.origin = None
+        self.values = np.empty(0, dtype=np.float64)
+        self.last = None  # highest utcstart loaded
+        self.recorded = None  # highest recordtime loaded, the incremental refresh continues from here
+        self.knots = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+        self.refreshed_at = None  # time.monotonic() of the last refresh, None until the first
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def prices_at(self, utcstarts) -> np.ndarray:
+        """Prices at the given utcstart minutes by direct indexing, NaN off the grid or outside the curve."""
+        utcstarts = np.asarray(utcstarts, dtype=np.int64)
+        prices = np.full(len(utcstarts), np.nan)
+        with self.lock:
+            if self.origin is None:
+                return prices
+            offset = utcstarts - self.origin
+            pos = offset // self.step
+            hit = (offset >= 0) & (offset % self.step == 0) & (pos < len(self.values))
+            prices[hit] = self.values[pos[hit]]
+        return prices
+
+    def update(self, utcstarts, prices, advance=True):
+        """
+        Merge new or corrected prices into the curve. advance=False leaves the refresh position alone,
+        for prices this process wrote itself while others may be writing too.
+        """
+        utcstarts = np.asarray(utcstarts, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        if len(utcstarts) == 0:
+            return
+        with self.lock:
+            if advance:
+                self.last = max(int(utcstarts.max()), self.last if self.last is not None else -1)
+            if self.stepwise:
+                known, known_prices = self.knots
+                merged = pd.Series(known_prices, index=known)
+                merged = pd.concat([merged, pd.Series(prices, index=utcstarts)])
+                merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+                self.knots = (merged.index.to_numpy(dtype=np.int64), merged.to_numpy(dtype=np.float64))
+                first = int(self.knots[0][0])
+                self.origin = first - first % self.step
+                grid = np.arange(self.origin, _next_local_month(int(self.knots[0][-1])), self.step, dtype=np.int64)
+                self.values = expand_prices(self.knots[0], self.knots[1], grid)
+                return
+            first = int(utcstarts.min())
+            first -= first % self.step
+            origin = first if self.origin is None else min(self.origin, first)
+            end = max(int(utcstarts.max()) + self.step, self.origin + len(self.values) * self.step if self.origin is not None else 0)
+            if self.origin != origin or len(self.values) < (end - origin) // self.step:
+                values = np.full((end - origin) // self.step, np.nan)
+                if self.origin is not None:
+                    shift = (self.origin - origin) // self.step
+                    values[shift:shift + len(self.values)] = self.values
+                self.origin, self.values = origin, values
+            self.values[(utcstarts - self.origin) // self.step] = prices
+
+    def save(self, folder):
+        """Write the curve to <folder>/<tsid>.npy (+ .json metadata) so later processes can memory-map it."""
+        os.makedirs(folder, exist_ok=True)
+        base = os.path.join(folder, str(self.tsid))
+        with self.lock:
+            with open(base + ".npy.tmp", "wb") as f:
+                np.save(f, np.asarray(self.values))
+            os.replace(base + ".npy.tmp", base + ".npy")
+            meta = {"step": self.step, "stepwise": self.stepwise, "origin": self.origin, "last": self.last,
+                    "recorded": self.recorded.isoformat() if self.recorded is not None else None,
+                    "knots": [self.knots[0].tolist(), self.knots[1].tolist()]}
+            with open(base + ".json.tmp", "w") as f:
+                json.dump(meta, f)
+            os.replace(base + ".json.tmp", base + ".json")
+
+    @staticmethod
+    def load(folder, tsid):
+        """Memory-map a saved curve (copy-on-write, updates stay in memory until the next save), None if absent."""
+        base = os.path.join(folder, str(tsid))
+        if not os.path.exists(base + ".json") or not os.path.exists(base + ".npy"):
+            return None
+        with open(base + ".json") as f:
+            meta = json.load(f)
+        curve = PriceCurve(tsid, meta["step"], meta["stepwise"])
+        curve.origin, curve.last = meta["origin"], meta["last"]
+        # curves saved before the recordtime watermark have none and are reloaded in full
+        curve.recorded = datetime.fromisoformat(meta["recorded"]) if meta.get("recorded") else None
+        curve.knots = (np.array(meta["knots"][0], dtype=np.int64), np.array(meta["knots"][1], dtype=np.float64))
+        curve.values = np.load(base + ".npy", mmap_mode="c")
+        return curve
+
+
+def local_month_starts(utcstarts) -> np.ndarray:
+    """utcstart minute of the Europe/Brussels month start containing each utcstart minute."""
+    times = pd.DatetimeIndex(pd.to_datetime(np.asarray(utcstarts, dtype=np.int64) * 60, unit="s", utc=True))
+    months = times.tz_convert("Europe/Brussels").tz_localize(None).to_period("M")
+    return months.to_timestamp().tz_localize("Europe/Brussels").as_unit("s").asi8 // 60
+
+
+def _next_local_month(utcstart: int) -> int:
+    """utcstart minute of the Europe/Brussels month start following the month of utcstart."""
+    local = pd.Timestamp(utcstart * 60, unit="s", tz="UTC").tz_convert("Europe/Brussels")
+    following = (local.tz_localize(None).to_period("M") + 1).to_timestamp().tz_localize("Europe/Brussels")
+    return int(following.timestamp()) // 60
+
+
+_price_curves = {}  # tsid -> PriceCurve, shared by all repositories in the process
+_price_curves_lock = threading.Lock()
+_aggregates_refreshed = {}  # (tsid, month utcstart) -> monotonic time monthly_average_at last refreshed it
+
+
 class TimeSeriesPriceRepository(Repository):
     def __init__(self):
         """Initialize TimeSeriesPriceRepository by inheriting Repository."""
@@ -53,6 +191,166 @@ class TimeSeriesPriceRepository(Repository):
             )
             return pd.read_sql_query(query.statement, session.bind)
 
+    def find_expanded_between_as_df(self, tsid, start_time, end_time, freq="15min"):
+        """
+        Price records of a step-wise price series (e.g. the monthly Endex quotations) expanded to
+        a regular `freq` grid over [start_time, end_time): every grid point takes the last price
+        at or before it. The expansion is done on read, nothing is stored at the fine resolution.
+        """
+        with self.new_session() as session:
+            # the last record before start_time is needed to price the first grid points
+            first = session.query(func.max(TimeSeriesPrice.utcstart)).filter(
+                TimeSeriesPrice.tsid == tsid,
+                TimeSeriesPrice.utcstart <= start_time.timestamp() // 60
+            ).scalar()
+            query = session.query(TimeSeriesPrice.utcstart, TimeSeriesPrice.price).filter(
+                TimeSeriesPrice.tsid == tsid,
+                TimeSeriesPrice.utcstart >= (first if first is not None else start_time.timestamp() // 60),
+                TimeSeriesPrice.utcstart < end_time.timestamp() // 60
+            ).order_by(TimeSeriesPrice.utcstart)
+            prices = pd.read_sql_query(query.statement, session.bind)
+        grid = pd.date_range(start_time, end_time, freq=freq, inclusive="left").tz_convert("UTC")
+        grid_minutes = grid.as_unit("s").asi8 // 60
+        return pd.DataFrame({
+            "tsid": tsid,
+            "utcstart": grid_minutes,
+            "price": expand_prices(prices["utcstart"].to_numpy(), prices["price"].to_numpy(dtype=np.float64), grid_minutes),
+            "utcstart_dt": grid,
+        })
+
+    def get_price_curve(self, tsid, stepwise=False, step=15, refresh=False) -> PriceCurve:
+        """
+        The in-process PriceCurve of tsid: loaded once (memory-mapped from PRICE_CACHE_FOLDER when
+        configured), then refreshed incrementally with the prices written since its last refresh at
+        most every PRICE_CACHE_TTL seconds, corrections of already loaded utcstarts included. Pass stepwise for curves like the monthly Endex quotations.
+        """
+        with _price_curves_lock:
+            curve = _price_curves.get(tsid)
+            if curve is None:
+                curve = (PRICE_CACHE_FOLDER and PriceCurve.load(PRICE_CACHE_FOLDER, tsid)) or PriceCurve(tsid, step, stepwise)
+                _price_curves[tsid] = curve
+        with curve.lock:
+            if refresh or curve.refreshed_at is None or time.monotonic() - curve.refreshed_at > PRICE_CACHE_TTL:
+                self._refresh_price_curve(curve)
+        return curve
+
+    def _refresh_price_curve(self, curve: PriceCurve):
+        with self.new_session() as session:
+            query = session.query(TimeSeriesPrice.utcstart, TimeSeriesPrice.price, TimeSeriesPrice.recordtime).filter(
+                TimeSeriesPrice.tsid == curve.tsid)
+            if curve.recorded is not None:
+                # upserts bump recordtime; >= so rows written in the same second as the watermark are not missed
+                query = query.filter(TimeSeriesPrice.recordtime >= curve.recorded)
+            prices = pd.read_sql_query(query.order_by(TimeSeriesPrice.utcstart).statement, session.bind)
+        curve.update(prices["utcstart"].to_numpy(), prices["price"].to_numpy(dtype=np.float64))
+        recorded = curve.recorded
+        if not prices.empty:
+            curve.recorded = pd.Timestamp(prices["recordtime"].max()).to_pydatetime()
+        curve.refreshed_at = time.monotonic()
+        # the rows at the watermark itself come back every refresh, only save when something newer arrived
+        if PRICE_CACHE_FOLDER and curve.recorded != recorded:
+            curve.save(PRICE_CACHE_FOLDER)
+
+    def prices_at(self, tsid, utcstarts, stepwise=False) -> np.ndarray:
+        """Price of tsid at every utcstart minute, from the cached curve."""
+        return self.get_price_curve(tsid, stepwise).prices_at(utcstarts)
+
+    def monthly_average_at(self, tsid, utcstarts) -> np.ndarray:
+        """
+        Average price of tsid over the full local month of every utcstart minute, NaN for months without
+        prices. Read from the ts_prices_agg table. A month that is missing there, has fewer prices than it
+        has quarter-hours or has not ended yet is recomputed first (at most every PRICE_CACHE_TTL seconds),
+        since prices reaching ts_prices through EDW do not pass bulk_upsert.
+        """
+        months = local_month_starts(utcstarts)
+        unique, inverse = np.unique(months, return_inverse=True)
+        if not len(unique):
+            return np.empty(0)
+        local_months = pd.to_datetime(unique * 60, unit="s", utc=True).tz_convert("Europe/Brussels").date
+        month_ends = np.array([_next_local_month(int(start)) for start in unique], dtype=np.int64)
+        averages, counts = self._read_monthly_aggregates(tsid, local_months)
+
+        now = int(time.time()) // 60
+        untrusted = np.isnan(averages) | (counts < (month_ends - unique) // 15) | (month_ends > now)
+        stale = [i for i in np.flatnonzero(untrusted)
+                 if _aggregates_refreshed.get((tsid, int(unique[i]))) is None
+                 or time.monotonic() - _aggregates_refreshed[(tsid, int(unique[i]))] > PRICE_CACHE_TTL]
+        if stale:
+            self.refresh_aggregates(tsid, int(unique[stale[0]]), int(unique[stale[-1]]))
+            for i in stale:
+                _aggregates_refreshed[(tsid, int(unique[i]))] = time.monotonic()
+            averages, counts = self._read_monthly_aggregates(tsid, local_months)
+
+        missing = np.flatnonzero(np.isnan(averages))
+        if len(missing):
+            curve = self.get_price_curve(tsid)
+            for i in missing:
+                prices = curve.prices_at(np.arange(unique[i], month_ends[i], curve.step))
+                if not np.isnan(prices).all():
+                    averages[i] = np.nanmean(prices)
+        return averages[inverse]
+
+    def _read_monthly_aggregates(self, tsid, local_months):
+        """price_avg and price_count of the given local months from ts_prices_agg, NaN/0 where absent."""
+        aggregates = self.find_aggregates(tsid, "M", local_months[0], local_months[-1]).set_index("localstart")
+        months = pd.Series(local_months)
+        averages = months.map(aggregates["price_avg"]).to_numpy(dtype=np.float64, copy=True)
+        counts = months.map(aggregates["price_count"]).fillna(0).to_numpy(dtype=np.int64, copy=True)
+        return averages, counts
+
+    def find_aggregates(self, tsid, period, first_local, last_local) -> pd.DataFrame:
+        """
+        Rows of the materialized ts_prices_agg table of tsid for period "M" (months) or "D" (days) whose
+        local start date lies in [first_local, last_local].
+        """
+        with self.new_session() as session:
+            return pd.read_sql_query(
+                text("""
+                SELECT localstart, utcstart, price_avg, price_min, price_max, price_count
+                FROM ts_prices_agg
+                WHERE tsid = :tsid AND period = :period AND localstart >= :first AND localstart <= :last
+                ORDER BY localstart
+                """),
+                session.bind,
+                params={"tsid": tsid, "period": period, "first": first_local, "last": last_local},
+                parse_dates=["localstart"],
+            ).assign(localstart=lambda df: df["localstart"].dt.date)
+
+    def refresh_aggregates(self, tsid, start_utc: int, end_utc: int, session=None):
+        """
+        Recompute the monthly and daily ts_prices_agg rows of every local month touching utcstart minutes
+        [start_utc, end_utc] from ts_prices. Only the affected months are read, so this stays cheap for
+        incremental loads; call it after prices were written outside bulk_upsert (e.g. through EDW).
+        """
+        lo = int(local_month_starts([start_utc])[0])
+        hi = _next_local_month(int(end_utc))
+        statements = [
+            ("M", "DATE_FORMAT(localstart, '%Y-%m-01')"),
+            ("D", "DATE(localstart)"),
+        ]
+        own_session = session is None
+        session = session or self.new_session()
+        try:
+            for period, period_start in statements:
+                session.execute(
+                    text(f"""
+                    INSERT INTO ts_prices_agg (tsid, period, localstart, utcstart, price_avg, price_min, price_max, price_count)
+                    SELECT tsid, '{period}', {period_start}, MIN(utcstart), AVG(price), MIN(price), MAX(price), COUNT(*)
+                    FROM ts_prices
+                    WHERE tsid = :tsid AND utcstart >= :lo AND utcstart < :hi
+                    GROUP BY tsid, {period_start}
+                    ON DUPLICATE KEY UPDATE
+                        utcstart = VALUES(utcstart), price_avg = VALUES(price_avg), price_min = VALUES(price_min),
+                        price_max = VALUES(price_max), price_count = VALUES(price_count)
+                    """),
+                    {"tsid": tsid, "lo": lo, "hi": hi}
+                )
+            if own_session:
+                session.commit()
+        finally:
+            if own_session:
+                session.close()
+
     def bulk_upsert(self, data):
         with self.new_session() as session:
             val = session.execute(
@@ -64,5 +362,14 @@ class TimeSeriesPriceRepository(Repository):
                 data
             )
             print(val.rowcount)
+            # maintain the monthly/daily aggregates of the touched months in the same transaction
+            rows = pd.DataFrame(data)
+            for tsid, group in rows.groupby("tsid") if not rows.empty else []:
+                self.refresh_aggregates(tsid, int(group["utcstart"].min()), int(group["utcstart"].max()), session)
             session.commit()
-            return len(data)
\ No newline at end of file
+        # keep cached curves current without waiting for their next refresh
+        for tsid, group in rows.groupby("tsid") if not rows.empty else []:
+            curve = _price_curves.get(tsid)
+            if curve is not None:
+                curve.update(group["utcstart"].to_numpy(), group["price"].to_numpy(dtype=np.float64), advance=False)
+        return len(data)
\ No newline at end of file
@@ -1,13 +1,16 @@
 import datetime
 import pandas as pd
-import mysql.connector
-from mysql.connector import pooling
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 import pytz
 import os
+import tempfile
+import time
 from dotenv import load_dotenv
 
+from backend.database.instrumentation import QueryInstrumentation
+from backend.database.pool import InstrumentedQueuePool, PoolMetrics
+
 # Load .env file
 load_dotenv()
 EDW_CONFIG = {
@@ -16,7 +19,15 @@ EDW_CONFIG = {
     "user": os.getenv("DB_USER"),
     "password": os.getenv("DB_PASSWORD"),
     "database": os.getenv("DB_DATABASE"),
-    "use_ssl": True if os.getenv("DB_USE_SSL")=="true" else False
+    "use_ssl": True if os.getenv("DB_USE_SSL")=="true" else False,
+    "pool_size": int(os.getenv("DB_POOL_SIZE", default="5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", default="10")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", default="3600")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", default="30")),
+    "local_infile": os.getenv("DB_LOCAL_INFILE") == "true",
+    "bulk_batch_size": int(os.getenv("DB_BULK_BATCH_SIZE", default="5000")),
+    "slow_query_ms": int(os.getenv("DB_SLOW_QUERY_MS", default="1000")),
+    "explain_slow": os.getenv("DB_EXPLAIN_SLOW", default="true") == "true",
 }
 
 
@@ -36,7 +47,9 @@ class MySQLDatabase:
         if MySQLDatabase._instance is not None:
             MySQLDatabase._instance.close()
 
-    def __init__(self, host, user, password, database, use_ssl, port=3306, pool_size=2):
+    def __init__(self, host, user, password, database, use_ssl, port=3306, pool_size=5, max_overflow=10,
+                 pool_recycle=3600, pool_timeout=30, local_infile=False, bulk_batch_size=5000,
+                 slow_query_ms=1000, explain_slow=True):
         self._host = host
         self._user = user
         self._password = password
@@ -44,6 +57,14 @@ class MySQLDatabase:
         self._port = port
         self._use_ssl = use_ssl
         self._pool_size = pool_size
+        self._max_overflow = max_overflow
+        self._pool_recycle = pool_recycle
+        self._pool_timeout = pool_timeout
+        self._local_infile = local_infile
+        self._bulk_batch_size = bulk_batch_size
+        # both kept across close(), so the counters cover the process lifetime
+        self._pool_metrics = PoolMetrics()
+        self._instrumentation = QueryInstrumentation(slow_seconds=slow_query_ms / 1000, explain=explain_slow)
         self._engine = None
         self._sessionmaker = None
 
@@ -54,16 +75,26 @@ class MySQLDatabase:
             connection_string = (
                 f"mysql+pymysql://{self._user}:{self._password}@{self._host}:{self._port}/{self._database}"
             )
+            pool_args = {
+                "poolclass": InstrumentedQueuePool,
+                "pool_size": self._pool_size,
+                "max_overflow": self._max_overflow,
+                "pool_recycle": self._pool_recycle,
+                "pool_timeout": self._pool_timeout,
+                "pool_pre_ping": True,
+            }
+            connect_args = {}
             if self._use_ssl:
                 # Dummy SSL configuration
-                ssl_args = {
-                    "ssl": {
-                        "ssl": True  # Enable SSL without specifying certificates
-                    }
+                connect_args["ssl"] = {
+                    "ssl": True  # Enable SSL without specifying certificates
                 }
-                self._engine = create_engine(connection_string, connect_args=ssl_args, pool_pre_ping=True)
-            else:
-                self._engine = create_engine(connection_string, pool_pre_ping=True)
+            if self._local_infile:
+                # needed for bulk_insert(method="load_data")
+                connect_args["local_infile"] = True
+            self._engine = create_engine(connection_string, connect_args=connect_args, **pool_args)
+            self._engine.pool.metrics = self._pool_metrics
+            self._instrumentation.attach(self._engine)
         return self._engine
 
     @property
@@ -83,12 +114,53 @@ class MySQLDatabase:
     def get_engine(self):
         return self.engine
 
+    def pool_status(self) -> dict:
+        """Live pool state (size, checked out, overflow) and the checkout wait / connect latency histograms."""
+        if self._engine is None:
+            return {"size": self._pool_size, "max_overflow": self._max_overflow, "connected": False,
+                    **self._pool_metrics.as_dict()}
+        return {"connected": True, **self._engine.pool.stats()}
+
+    def query_report(self, name: str, print_report: bool = True):
+        """
+        Context manager collecting timing, row counts and slow queries of every statement run inside it,
+        e.g. `with database.query_report("peaks"): ...`. Yields the QueryStats of the block.
+        """
+        return self._instrumentation.report(name, print_report)
+
+    def query_stats(self, top: int = None) -> dict:
+        """Per-statement fingerprint totals since the process started."""
+        return self._instrumentation.totals.as_dict(top)
+
     def query(self, sql, timecols=None):
 
         result = pd.read_sql_query(sql, self.engine, parse_dates=timecols)
 
         return result
 
+    def query_iter(self, sql, chunksize=100_000, timecols=None, as_numpy=False):
+        """
+        Stream the result of sql in chunks of at most chunksize rows through a server-side cursor, so
+        memory stays bounded by one chunk. Yields DataFrames, or dicts of column name -> numpy array
+        when as_numpy is set. The connection stays checked out until the generator is exhausted or closed.
+        """
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, max_row_buffer=chunksize).execute(text(sql))
+            columns = list(result.keys())
+            count = 0
+            try:
+                for rows in result.partitions(chunksize):
+                    count += len(rows)
+                    df = pd.DataFrame.from_records(rows, columns=columns)
+                    for col in timecols or []:
+                        df[col] = pd.to_datetime(df[col])
+                    if as_numpy:
+                        yield {col: df[col].to_numpy() for col in columns}
+                    else:
+                        yield df
+            finally:
+                self._instrumentation.streamed_rows(connection, count)
+
     def delete(self, table, where):
         with self.engine.connect() as connection:
             connection.execute(f"DELETE FROM {table} WHERE {where}")
@@ -113,38 +185,92 @@ class MySQLDatabase:
             cursor.executemany(sql, values)
             connection.commit()
 
-    def bulk_insert(self, df, table='', key_cols=[], data_cols=[], where=None, moddate_col=None):
+    def bulk_insert(self, df, table='', key_cols=[], data_cols=[], where=None, moddate_col=None, batch_size=None,
+                    method="values"):
         """
-        Performs a MySQL-style UPSERT using INSERT ... ON DUPLICATE KEY UPDATE
+        Performs a MySQL-style UPSERT using INSERT ... ON DUPLICATE KEY UPDATE, streaming the frame in
+        batches of batch_size rows (DB_BULK_BATCH_SIZE), each committed on its own.
+
+        method="values" sends every batch as one multi-row INSERT. method="load_data" loads every batch
+        with LOAD DATA LOCAL INFILE into a temporary staging table and upserts it with one
+        INSERT ... SELECT; it needs DB_LOCAL_INFILE=true. Returns rows, batches, seconds and rows_per_sec.
         """
-        with self.engine.connect() as connection:
-            cursor = connection.connection.cursor()
-
-            # Construct column lists
-            all_cols = key_cols + data_cols
-            if moddate_col:
-                all_cols.append(moddate_col)
-
-            # Create placeholders for values
-            placeholders = ','.join(['%s'] * len(all_cols))
-            update_clause = ','.join([f"{col}=VALUES({col})" for col in data_cols])
-            if moddate_col:
-                update_clause += f", {moddate_col}=CURRENT_TIMESTAMP"
-
-            # Construct the query
-            sql = f"""
-                INSERT INTO {table} ({','.join(all_cols)})
-                VALUES ({placeholders})
-                ON DUPLICATE KEY UPDATE {update_clause}
-            """
-
-            # Prepare data
-            values = [tuple(row) + (None,) if moddate_col else tuple(row) 
-                     for row in df[all_cols if not moddate_col else all_cols[:-1]].values]
-
-            # Execute
-            cursor.executemany(sql, values)
-            connection.commit()
+        batch_size = batch_size or self._bulk_batch_size
+        all_cols = key_cols + data_cols
+        update_clause = ','.join([f"{col}=VALUES({col})" for col in data_cols])
+        if moddate_col:
+            update_clause += f", {moddate_col}=CURRENT_TIMESTAMP"
+
+        start = time.perf_counter()
+        batches = 0
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if method == "load_data":
+                cursor.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {table}_stage LIKE {table}")
+            frame = df[all_cols]  # select the columns once, slicing per batch does not copy the frame
+            for offset in range(0, len(frame), batch_size):
+                batch = frame.iloc[offset:offset + batch_size]
+                if method == "load_data":
+                    self._load_data_batch(cursor, batch, table, all_cols, moddate_col, update_clause)
+                else:
+                    self._insert_values_batch(cursor, batch, table, all_cols, moddate_col, update_clause)
+                connection.commit()
+                batches += 1
+            if method == "load_data":
+                cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {table}_stage")
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        seconds = time.perf_counter() - start
+        stats = {
+            "rows": len(df),
+            "batches": batches,
+            "seconds": seconds,
+            "rows_per_sec": len(df) / seconds if seconds else 0.0,
+        }
+        print(f"bulk_insert {table}: {stats['rows']} rows in {batches} batches, {seconds:.2f}s "
+              f"({stats['rows_per_sec']:.0f} rows/s)")
+        return stats
+
+    @staticmethod
+    def _insert_values_batch(cursor, batch, table, all_cols, moddate_col, update_clause):
+        cols = all_cols + [moddate_col] if moddate_col else all_cols
+        row = '(' + ','.join(['%s'] * len(all_cols) + (['NULL'] if moddate_col else [])) + ')'
+        sql = f"""
+            INSERT INTO {table} ({','.join(cols)})
+            VALUES {','.join([row] * len(batch))}
+            ON DUPLICATE KEY UPDATE {update_clause}
+        """
+        # NaN/NaT are not valid MySQL values, send them as NULL
+        values = batch.astype(object).where(batch.notna(), None).to_numpy().ravel().tolist()
+        cursor.execute(sql, values)
+
+    @staticmethod
+    def _load_data_batch(cursor, batch, table, all_cols, moddate_col, update_clause):
+        stage = f"{table}_stage"
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            batch.to_csv(f, header=False, index=False, na_rep="\\N", date_format="%Y-%m-%d %H:%M:%S")
+        try:
+            cursor.execute(f"DELETE FROM {stage}")
+            cursor.execute(f"""
+                LOAD DATA LOCAL INFILE %s INTO TABLE {stage}
+                FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+                LINES TERMINATED BY '\\n'
+                ({','.join(all_cols)})
+            """, (f.name,))
+        finally:
+            os.remove(f.name)
+        cols = all_cols + [moddate_col] if moddate_col else all_cols
+        select = ','.join(all_cols + (['NULL'] if moddate_col else []))
+        cursor.execute(f"""
+            INSERT INTO {table} ({','.join(cols)})
+            SELECT {select} FROM {stage}
+            ON DUPLICATE KEY UPDATE {update_clause}
+        """)
 
 if __name__ == "__main__":
     # Example usage
@@ -0,0 +1,167 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+_COMMENTS = re.compile(r"/\*.*?\*/|--[^\n]*", re.DOTALL)
+_STRINGS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"%\(\w+\)s|%s|:\w+|\?")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# reports opened with QueryInstrumentation.report() in the current thread / task
+_active_reports: ContextVar[tuple] = ContextVar("active_query_reports", default=())
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Normalize a statement so executions that differ only in literals, placeholders, IN-list or VALUES
+    length and whitespace group together.
+    """
+    sql = _COMMENTS.sub(" ", statement)
+    sql = _STRINGS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    sql = _PLACEHOLDERS.sub("?", sql)
+    sql = _IN_LISTS.sub("(?+)", sql)
+    sql = re.sub(r"(\(\?\+?\))(?:\s*,\s*\(\?\+?\))+", r"\1+", sql)  # multi-row VALUES
+    return _WHITESPACE.sub(" ", sql).strip().lower()
+
+
+class QueryStats:
+    """Per-fingerprint count, duration and row totals plus the slow queries of one collection period."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.seconds = None
+        self._lock = threading.Lock()
+        self.statements = {}
+        self.slow = []
+
+    def record(self, fp: str, seconds: float, rows: int):
+        with self._lock:
+            stats = self.statements.setdefault(fp, {"count": 0, "seconds": 0.0, "max": 0.0, "rows": 0})
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["rows"] += max(rows, 0)
+
+    def add_rows(self, fp: str, rows: int):
+        """Add rows counted after the statement was recorded, e.g. once a streamed result is read."""
+        with self._lock:
+            if fp in self.statements:
+                self.statements[fp]["rows"] += rows
+
+    def record_slow(self, fp: str, statement: str, seconds: float, rows: int, explain):
+        with self._lock:
+            self.slow.append({"fingerprint": fp, "statement": statement, "seconds": seconds, "rows": rows,
+                              "explain": explain})
+
+    def as_dict(self, top: int = None) -> dict:
+        with self._lock:
+            statements = sorted(self.statements.items(), key=lambda kv: kv[1]["seconds"], reverse=True)
+            return {
+                "name": self.name,
+                "seconds": self.seconds if self.seconds is not None else time.perf_counter() - self.started,
+                "queries": sum(s["count"] for _, s in statements),
+                "query_seconds": sum(s["seconds"] for _, s in statements),
+                "statements": [dict(fingerprint=fp, **s) for fp, s in statements[:top]],
+                "slow": list(self.slow),
+            }
+
+    def print_report(self, top: int = 10):
+        report = self.as_dict(top)
+        print(f"SQL report {report['name']}: {report['queries']} queries, {report['query_seconds']:.2f}s "
+              f"of {report['seconds']:.2f}s, {len(report['slow'])} slow")
+        for s in report["statements"]:
+            print(f"  {s['count']:>6}x {s['seconds']:>8.3f}s max {s['max']:.3f}s {s['rows']:>10} rows  "
+                  f"{s['fingerprint'][:120]}")
+
+
+class QueryInstrumentation:
+    """
+    Engine-level before/after_cursor_execute hooks recording duration, row count and fingerprint of
+    every statement. Statements slower than slow_seconds are logged and, for SELECTs that are not
+    streamed, their EXPLAIN is captured. Statistics are kept in a process-wide total and in the
+    reports opened with report() in the executing thread or task.
+    """
+
+    def __init__(self, slow_seconds: float = 1.0, explain: bool = True):
+        self.slow_seconds = slow_seconds
+        self.explain = explain
+        self.totals = QueryStats("total")
+
+    def attach(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # on the execution context, so a statement that raises leaves nothing behind on the connection
+        context._query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context._query_start
+        # a streamed (server-side cursor) result has not been read yet, its rows are added by streamed_rows()
+        streaming = bool(context.execution_options.get("stream_results"))
+        rows = -1 if streaming else cursor.rowcount
+        fp = fingerprint(statement)
+        collectors = (self.totals,) + _active_reports.get()
+        if streaming:
+            conn.info["streamed_statement"] = (fp, collectors)
+        for stats in collectors:
+            stats.record(fp, seconds, rows)
+        if seconds >= self.slow_seconds:
+            explain = None
+            if self.explain and not streaming and not executemany and _is_select(statement):
+                explain = self._explain(conn, statement, parameters)
+            print(f"Slow query ({seconds:.3f}s, {rows} rows): {fp[:200]}")
+            for stats in collectors:
+                stats.record_slow(fp, statement, seconds, rows, explain)
+
+    @staticmethod
+    def streamed_rows(conn, rows: int):
+        """Add the rows read from the last streamed statement on conn to the stats it was recorded in."""
+        streamed = conn.info.pop("streamed_statement", None)
+        if streamed is not None:
+            fp, collectors = streamed
+            for stats in collectors:
+                stats.add_rows(fp, rows)
+
+    @staticmethod
+    def _explain(conn, statement, parameters):
+        # on the raw DBAPI cursor, so the EXPLAIN itself does not go through these hooks
+        try:
+            cursor = conn.connection.cursor()
+            try:
+                if parameters:
+                    cursor.execute("EXPLAIN " + statement, parameters)
+                else:
+                    cursor.execute("EXPLAIN " + statement)
+                columns = [d[0] for d in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+        except Exception as e:
+            return [{"error": str(e)}]
+
+    @contextmanager
+    def report(self, name: str, print_report: bool = True):
+        """Collect the statements executed inside the block into their own QueryStats."""
+        stats = QueryStats(name)
+        token = _active_reports.set(_active_reports.get() + (stats,))
+        try:
+            yield stats
+        finally:
+            _active_reports.reset(token)
+            stats.seconds = time.perf_counter() - stats.started
+            if print_report:
+                stats.print_report()
+
+
+def _is_select(statement: str) -> bool:
+    head = _COMMENTS.sub(" ", statement).lstrip().lower()
+    return head.startswith("select") or head.startswith("with")
@@ -0,0 +1,3 @@
+-- Composite index for StatisticsRepository.find_many: filters on tsid and statkey, range on fromutc.
+ALTER TABLE nett.statistics
+    ADD INDEX ix_statistics_tsid_statkey_fromutc (tsid, statkey, fromutc);
@@ -0,0 +1,27 @@
+-- Materialized monthly ('M') and daily ('D') price aggregates per price series, keyed by the local
+-- (Europe/Brussels) start date of the period. Maintained by TimeSeriesPriceRepository.bulk_upsert /
+-- refresh_aggregates for the months it touches. monthly_average_at (average-EPEX in
+-- ContractTypeEvaluation) recomputes months that are missing, incomplete or not yet over before reading.
+CREATE TABLE edw.ts_prices_agg (
+    tsid        INT          NOT NULL,
+    period      CHAR(1)      NOT NULL,
+    localstart  DATE         NOT NULL,
+    utcstart    INT          NOT NULL,
+    price_avg   DECIMAL(11,4) NULL,
+    price_min   DECIMAL(7,2) NULL,
+    price_max   DECIMAL(7,2) NULL,
+    price_count INT          NOT NULL,
+    recordtime  TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (tsid, period, localstart)
+);
+
+-- Initial fill from the full price history
+INSERT INTO edw.ts_prices_agg (tsid, period, localstart, utcstart, price_avg, price_min, price_max, price_count)
+SELECT tsid, 'M', DATE_FORMAT(localstart, '%Y-%m-01'), MIN(utcstart), AVG(price), MIN(price), MAX(price), COUNT(*)
+FROM edw.ts_prices
+GROUP BY tsid, DATE_FORMAT(localstart, '%Y-%m-01');
+
+INSERT INTO edw.ts_prices_agg (tsid, period, localstart, utcstart, price_avg, price_min, price_max, price_count)
+SELECT tsid, 'D', DATE(localstart), MIN(utcstart), AVG(price), MIN(price), MAX(price), COUNT(*)
+FROM edw.ts_prices
+GROUP BY tsid, DATE(localstart);
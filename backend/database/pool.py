@@ -0,0 +1,127 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds (seconds) of the histogram buckets, the last bucket catches everything above
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+class Histogram:
+    """Fixed-bucket latency histogram, safe to update from several threads."""
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * len(self.buckets)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def observe(self, seconds: float):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+                    break
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "avg": self.total / self.count if self.count else 0.0,
+                "max": self.max,
+                "buckets": {
+                    ("+Inf" if bound == float("inf") else f"{bound:g}"): count
+                    for bound, count in zip(self.buckets, self.counts)
+                },
+            }
+
+
+class PoolMetrics:
+    """Checkout wait and connect latency of a connection pool, plus checkout/timeout counters."""
+
+    def __init__(self):
+        self.checkout_wait = Histogram()
+        self.connect_latency = Histogram()
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connect_errors = 0
+
+    def count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "connect_errors": self.connect_errors,
+            "checkout_wait": self.checkout_wait.as_dict(),
+            "connect_latency": self.connect_latency.as_dict(),
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that records how long a checkout waits for a connection and how long opening a new
+    connection takes. The metrics object survives engine.dispose(), which recreates the pool.
+    """
+
+    def __init__(self, *args, metrics: PoolMetrics = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics or PoolMetrics()
+        self._local = threading.local()
+
+    def _do_get(self):
+        # QueuePool._do_get retries by calling itself, only time the outermost call
+        if getattr(self._local, "in_checkout", False):
+            return super()._do_get()
+        self._local.in_checkout = True
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.count("timeouts")
+            raise
+        finally:
+            self._local.in_checkout = False
+        # includes the connect time when the checkout had to open a new connection
+        self.metrics.checkout_wait.observe(time.perf_counter() - start)
+        self.metrics.count("checkouts")
+        return record
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        try:
+            record = super()._create_connection()
+        except Exception:
+            self.metrics.count("connect_errors")
+            raise
+        self.metrics.connect_latency.observe(time.perf_counter() - start)
+        return record
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "max_overflow": self._max_overflow,
+            "timeout": self.timeout(),
+            **self.metrics.as_dict(),
+        }
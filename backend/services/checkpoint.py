@@ -0,0 +1,47 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+CHECKPOINT_FOLDER = os.path.join("data", "checkpoints")  # Folder holding the checkpoint files
+
+
+class CheckpointStore:
+    """
+    Per-site ingestion checkpoints, persisted as one JSON file per ingestion source
+    (<folder>/<name>.json). A checkpoint is the end of the last window that was stored.
+    """
+
+    def __init__(self, name: str, folder: str = None):
+        self.folder = folder or os.getenv("CHECKPOINT_FOLDER", default=CHECKPOINT_FOLDER)
+        self.path = os.path.join(self.folder, f"{name}.json")
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _save(self, checkpoints: dict):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(checkpoints, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def get(self, site_id) -> datetime:
+        with self._lock:
+            value = self._load().get(str(site_id))
+        return datetime.fromisoformat(value) if value else None
+
+    def set(self, site_id, dt: datetime):
+        with self._lock:
+            checkpoints = self._load()
+            checkpoints[str(site_id)] = dt.isoformat()
+            self._save(checkpoints)
+
+    def clear(self, site_id):
+        with self._lock:
+            checkpoints = self._load()
+            if checkpoints.pop(str(site_id), None) is not None:
+                self._save(checkpoints)
@@ -2,9 +2,16 @@ import pandas as pd
 import pytz
 import requests
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from backend.services.edw import EDWApi, DataPoint, TimeSeries
+from backend.services.edw import EDWApi, DataPoint, DataPointBatch, TimeSeries
+from backend.services.siterunner import SiteRunner
+from backend.services.checkpoint import CheckpointStore
+from backend.services.gaps import GapScanner
+from backend.services.fingerprint import ChangeOnlyWriter
 load_dotenv()
 
 class E2XAPI:
@@ -16,6 +23,17 @@ class E2XAPI:
         self.password = os.getenv("E2X_PASSWORD")
         self.edw_api = EDWApi()
         self.site_ids = ["EF9904F2", "83325360", "4BE09281"]
+        # number of quarter-hour requests in flight per site, and number of sites fetched at once
+        self.concurrency = int(os.getenv("E2X_CONCURRENCY", default="8"))
+        self.workers = int(os.getenv("INGEST_WORKERS", default="4"))
+        self.gap_scanner = GapScanner(self.edw_api)
+        self.writer = ChangeOnlyWriter(self.edw_api)
+        # window scanned for missing quarter-hours on every run, counted in whole days before today
+        self.lookback = timedelta(days=int(os.getenv("E2X_LOOKBACK_DAYS", default="1")))
+        self.checkpoints = CheckpointStore("cioc")
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency * self.workers))
+        self._auth_lock = threading.Lock()
 
     def authenticate(self, username=None, password=None):
         """
@@ -33,7 +51,7 @@ class E2XAPI:
         }
 
         try:
-            response = requests.post(url, json=payload)
+            response = self.session.post(url, json=payload)
             response.raise_for_status()  # Raises an error for 4xx/5xx responses
 
             data = response.json()
@@ -41,6 +59,7 @@ class E2XAPI:
             self.headers = {
                 "Authorization": f"Bearer {self.token}"
             }
+            self.session.headers.update(self.headers)
             return True
 
         except requests.exceptions.HTTPError as e:
@@ -57,90 +76,116 @@ class E2XAPI:
 
     def get_site_data(self, site_key, fromdt=None, todt=None):
         """
-        Retrieve energy information for a specific site.
+        Retrieve energy information for a specific site, one request per quarter-hour in [fromdt, todt).
+        Up to self.concurrency requests run at once over the shared authenticated session.
         Args:
             site_key (str): The ID of the site associated with the BESS.
-            quarter_hour (str, optional): UTC timestamp in the format %Y-%m-%dT%H:%M:%SZ.
-                                         Example: 2025-01-17T02:00:00Z
+            fromdt (datetime): First quarter-hour, timezone aware.
+            todt (datetime): End of the range (exclusive), timezone aware.
         Returns:
-            dict: Energy information if successful, None otherwise.
+            DataFrame: Energy information in time order if successful, None otherwise.
         """
         if not self.token:
             print("Error: You must authenticate first.")
             return None
 
         url = f"{self.base_url}/energy-info/{site_key}"
-        params = {}
 
+        quarter_hours = []
         dt = fromdt.astimezone(pytz.utc)
-        result = []
         while  dt < todt:
-            # "2025-03-28T12:00:00Z"
-            params["quarter_hour"] = self.utcformat(dt)
-
-            try:
-                response = requests.get(url, headers=self.headers, params=params)
-                response.raise_for_status()
-
-                data = response.json()
-                data["UTCTIME"] = dt
-                result.append(data)
-                # print("received data for", dt.isoformat())
-
-            except requests.exceptions.HTTPError as e:
-                if response.status_code == 400:
-                    print("Error: Invalid or missing parameters, or insufficient permissions.")
-                    return None
-                elif response.status_code == 401:
-                    print("Error: Authentication failed. Invalid credentials.")
-                    return None
-                else:
-                    print(f"Error retrieving energy info: {e}")
-            except Exception as e:
-                print(f"Error during energy info retrieval: {e}")
-                return None
-
+            quarter_hours.append(dt)
             dt = dt + timedelta(minutes=15)
 
+        result = []
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            # results are collected in submission order, so the frame stays sorted by time
+            futures = [executor.submit(self._get_quarter_hour, url, dt) for dt in quarter_hours]
+            for future in futures:
+                data = future.result()
+                if data is not None:
+                    result.append(data)
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 400:
+                print("Error: Invalid or missing parameters, or insufficient permissions.")
+            else:
+                print("Error: Authentication failed. Invalid credentials.")
+            return None
+        except Exception as e:
+            print(f"Error during energy info retrieval: {e}")
+            return None
+        finally:
+            executor.shutdown(cancel_futures=True)
+
         return pd.DataFrame(result)
 
+    def _get_quarter_hour(self, url, dt):
+        """
+        Fetch the energy info of one quarter-hour. A 401 re-authenticates once and retries;
+        400 and a second 401 raise, other HTTP errors skip the quarter-hour.
+        """
+        # "2025-03-28T12:00:00Z"
+        params = {"quarter_hour": self.utcformat(dt)}
+        token = self.token
+        response = self.session.get(url, params=params)
+        if response.status_code == 401 and self._reauthenticate(token):
+            response = self.session.get(url, params=params)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            if response.status_code in (400, 401):
+                raise
+            print(f"Error retrieving energy info: {e}")
+            return None
+
+        data = response.json()
+        data["UTCTIME"] = dt
+        return data
+
+    def _reauthenticate(self, stale_token):
+        """Refresh an expired token once, however many concurrent requests saw it expire."""
+        with self._auth_lock:
+            if self.token != stale_token:
+                return True
+            print("Token rejected, re-authenticating...")
+            return self.authenticate()
+
     def create_timeseries(self, site_id):
-        timeseries = self.edw_api.get_timeseries()
-        ts = next(filter(lambda x: x.name == f"cioc/{site_id}", timeseries), None)
+        ts = self.edw_api.find_timeseries(f"cioc/{site_id}")
         if not ts:
-            vault = next(filter(lambda x: x.name== "elion", self.edw_api.get_vaults()), None)
+            vault = self.edw_api.find_vault("elion")
             if vault:
                 res = self.edw_api.create_timeseries("cioc/"+site_id, f"cioc", "PT15M", None, None, None, None)
                 print("created timeseries", res)
                 return res
 
     def find_or_create_timeseries(self, site_id):
-        timeseries = self.edw_api.get_timeseries()
-        ts = next(filter(lambda x: x.name == f"cioc/{site_id}", timeseries), None)
+        ts = self.edw_api.find_timeseries(f"cioc/{site_id}")
         if ts:
             return ts
         else:
             print(f"Timeseries for site {site_id} not found, creating...")
-            ts_json = self.create_timeseries(site_id)
-            ts_json["firstTime"] = None
-            ts_json["lastTime"] = None
-            return TimeSeries(**ts_json)
+            self.create_timeseries(site_id)
+            # create_timeseries invalidated the catalog, so this reloads it once
+            return self.edw_api.find_timeseries(f"cioc/{site_id}")
 
     def utcformat(self, dt):
         return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
 
     def store_data(self, ts, df):
-        insert_data = [
-            DataPoint(
-                start=self.utcformat(row["UTCTIME"]),
-                values=[row['Grid_energy_in']/10,
-                        row['Grid_energy_out']/10,
-                        row['Solar_energy_in']/10 if row['Solar_energy_in'] else 0,
-                        row['Battery_energy_in']/10 if row['Battery_energy_in'] else 0,
-                        row['Battery_energy_out']/10 if row['Battery_energy_in'] else 0])
-            for _, row in df.iterrows()
-        ]
-        self.edw_api.store_datapoints(ts.id, insert_data)
+        battery_in = df['Battery_energy_in'].astype(float).fillna(0)
+        values = pd.DataFrame({
+            "offtake": df['Grid_energy_in'].astype(float)/10,
+            "injection": df['Grid_energy_out'].astype(float)/10,
+            "production": df['Solar_energy_in'].astype(float).fillna(0)/10,
+            "charge": battery_in/10,
+            # discharge is only reported when the battery reading is present, as before
+            "discharge": (df['Battery_energy_out'].astype(float)/10).where(battery_in != 0, 0),
+            "UTCTIME": df["UTCTIME"],
+        })
+        insert_data = DataPointBatch.from_dataframe(values, "UTCTIME", ["offtake", "injection", "production", "charge", "discharge"])
+        return self.writer.store(ts, insert_data)
 
     def create_timeseries_structure(self):
         """
@@ -158,18 +203,48 @@ class E2XAPI:
             ts = self.edw_api.create_timeseries(f"cioc/{site_id}", "cioc", "PT15M", None, None, None, None)
             print("created timeseries", ts)
 
-    def run(self):
+    def _fetch_site(self, site_id, fromutc, toutc):
+        """
+        Fetch only the intervals the site's series is missing between fromutc and toutc. The scan starts
+        no later than half an hour before the series' lastTime, so an outage longer than the lookback is
+        still caught up; the lookback only adds coverage for holes before that.
+        """
+        ts = self.find_or_create_timeseries(site_id)
+        if ts.lastTime is not None:
+            fromutc = min(fromutc, ts.lastTime - timedelta(minutes=30))
+        gaps = self.gap_scanner.scan(ts, fromutc, toutc)
+        print(f"Fetching {len(gaps)} missing intervals for site {site_id} between {fromutc} and {toutc}")
+        frames = []
+        for start, end in gaps:
+            df = self.get_site_data(site_id, start, end)
+            if df is None:
+                return ts, None
+            frames.append(df)
+        return ts, pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def backfill(self, site_id, fromutc, toutc, window=None):
+        """Ingest [fromutc, toutc) window by window, resuming from the site's checkpoint."""
+        ts = self.find_or_create_timeseries(site_id)
+        if ts.lastTime is not None:
+            fromutc = ts.lastTime - timedelta(minutes=30)
+        print(f"Backfilling site {site_id} from {fromutc} to {toutc}")
+        return SiteRunner.backfill(site_id, fromutc, toutc,
+                                   fetch=self.get_site_data,
+                                   store=lambda df: self.store_data(ts, df),
+                                   checkpoints=self.checkpoints, window=window)
+
+    def run(self, backfill=False):
         if self.authenticate():
-            fromutc = datetime.now(pytz.UTC) - timedelta(days=1)
+            fromutc = datetime.now(pytz.UTC) - self.lookback
             fromutc = fromutc.replace(hour=0, minute=0, second=0, microsecond=0)
             toutc = datetime.now(pytz.UTC)
-            for site_id in self.site_ids:
-                ts = self.find_or_create_timeseries(site_id)
-                if ts.lastTime is not None:
-                    fromutc = ts.lastTime - timedelta(minutes=30)
-                print(f"Fetching data for site {site_id} from {fromutc} to {toutc}")
-                df = self.get_site_data(site_id, fromutc, toutc)
-                self.store_data(ts, df)
+            if backfill:
+                return SiteRunner(self.workers).run_each(self.site_ids, lambda site_id: self.backfill(site_id, fromutc, toutc))
+            return SiteRunner(self.workers).run(
+                self.site_ids,
+                fetch=lambda site_id: self._fetch_site(site_id, fromutc, toutc),
+                store=lambda site_id, ts, df: self.store_data(ts, df),
+            )
         else:
             print("Authentication failed. Cannot run the process.")
 
@@ -1,10 +1,18 @@
 import pandas as pd
+import numpy as np
 import requests
 import os
-from dataclasses import dataclass
-from typing import List, Union
-from datetime import datetime
+import gzip
+from requests.adapters import HTTPAdapter
+from dataclasses import dataclass, field
+from typing import List, Union, Tuple
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+from concurrent.futures import ThreadPoolExecutor
 import json
+import time
+import threading
+from itertools import chain
 import pytz
 from dotenv import load_dotenv
 
@@ -44,6 +52,14 @@ class TimeSeries:
     modifiedAt: datetime
     vault: Vault
 
+    @property
+    def vaultName(self) -> str:
+        return self.vault["name"] if self.vault else None
+
+    @property
+    def fieldNames(self) -> List[str]:
+        return [x["name"] for x in self.vault["recordSpec"]["fieldSpecs"]]
+
 @dataclass
 class DataPoint:
     start: str
@@ -53,33 +69,208 @@ class DataPoint:
         self.values.extend(values)
         return self
 
+@dataclass
+class DataPointBatch:
+    """
+    Columnar alternative to a list of DataPoint: an int64 vector of epoch seconds (UTC) and a
+    (rows, fields) float matrix, plus the field names of the matrix columns.
+    """
+    times: np.ndarray
+    values: np.ndarray
+    fields: List[str] = None
+
+    def __post_init__(self):
+        self.times = np.asarray(self.times, dtype=np.int64)
+        self.values = np.asarray(self.values, dtype=np.float64)
+        if self.values.ndim == 1:
+            self.values = self.values.reshape(-1, 1)
+        if len(self.times) != len(self.values):
+            raise ValueError(f"{len(self.times)} times for {len(self.values)} value rows")
+
+    def __len__(self):
+        return len(self.times)
+
+    def slice(self, start: int, stop: int) -> "DataPointBatch":
+        return DataPointBatch(self.times[start:stop], self.values[start:stop], self.fields)
+
+    @staticmethod
+    def from_dataframe(df: pd.DataFrame, time_col: str, val_cols: Union[str, List[str]]) -> "DataPointBatch":
+        """Build a batch from a time column and value columns. Naive times are taken as UTC."""
+        val_cols = val_cols if isinstance(val_cols, list) else [val_cols]
+        times = pd.DatetimeIndex(df[time_col])
+        if times.tz is None:
+            times = times.tz_localize("UTC")
+        return DataPointBatch(times.as_unit("s").asi8, df[val_cols].to_numpy(dtype=np.float64), val_cols)
+
+    @staticmethod
+    def from_datapoints(datapoints: List[DataPoint], fields: List[str] = None) -> "DataPointBatch":
+        starts = pd.DatetimeIndex(pd.to_datetime([dp.start for dp in datapoints], utc=True, format="ISO8601"))
+        return DataPointBatch(starts.as_unit("s").asi8, np.array([dp.values for dp in datapoints], dtype=np.float64), fields)
+
+    def to_datapoints(self) -> List[DataPoint]:
+        starts = np.datetime_as_string(self.times.astype("datetime64[s]"), unit="s", timezone="UTC").tolist()
+        return [DataPoint(start=start, values=values) for start, values in zip(starts, self.values.tolist())]
 
-class EDWApi:
-
-    def __init__(self):
+@dataclass
+class BatchResult:
+    """Outcome of posting one batch of datapoints. Failed batches keep their payload so they can be retried alone."""
+    index: int
+    rows: int
+    status: int = None
+    response: object = None
+    error: str = None
+    payload: list = field(default=None, repr=False)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status is not None and 200 <= self.status < 300
+
+
+def decode_datapoints(data: list, field_names: List[str], dtype=np.float64) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Decode a /values response straight into columnar arrays: an int64 vector of epoch seconds
+    and a contiguous (rows, fields) value matrix of the requested dtype. Missing values become NaN.
+    """
+    n = len(data)
+    matrix = np.fromiter(chain.from_iterable(item["values"] for item in data), dtype=dtype, count=n * len(field_names))
+    matrix = matrix.reshape(n, len(field_names))
+    starts = np.fromiter((item["start"] for item in data), dtype=object, count=n)
+    times = pd.to_datetime(starts, utc=True, format="ISO8601").as_unit("s").asi8
+    return times, matrix, field_names
+
+
+def datapoints_frame(times: np.ndarray, matrix: np.ndarray, field_names: List[str]) -> pd.DataFrame:
+    """Wrap decoded arrays in a DataFrame with a UTC 'start' column, without copying the value matrix."""
+    df = pd.DataFrame(matrix, columns=field_names, copy=False)
+    df.insert(0, "start", pd.to_datetime(times, unit="s", utc=True).as_unit("ns"))
+    return df
+
+
+class TimeSeriesCatalog:
+    """
+    TTL cache of the EDW timeseries and vault catalog with O(1) lookups by name, by id and
+    by vault name. One catalog is shared by all clients talking to the same endpoint, see
+    EDWApi.catalog.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._timeseries = None
+        self._timeseries_loaded_at = 0.0
+        self._by_name = {}
+        self._by_id = {}
+        self._by_vault = {}
+        self._vaults = None
+        self._vaults_loaded_at = 0.0
+        self._vaults_by_name = {}
+
+    def _expired(self, loaded_at):
+        return time.monotonic() - loaded_at > self.ttl
+
+    def timeseries(self, loader, refresh=False) -> List[TimeSeries]:
+        with self._lock:
+            if refresh or self._timeseries is None or self._expired(self._timeseries_loaded_at):
+                timeseries = loader()
+                by_vault = {}
+                for ts in timeseries:
+                    by_vault.setdefault(ts.vaultName, []).append(ts)
+                self._timeseries = timeseries
+                self._by_name = {ts.name: ts for ts in timeseries}
+                self._by_id = {ts.id: ts for ts in timeseries}
+                self._by_vault = by_vault
+                self._timeseries_loaded_at = time.monotonic()
+            return self._timeseries
+
+    def vaults(self, loader, refresh=False) -> List[Vault]:
+        with self._lock:
+            if refresh or self._vaults is None or self._expired(self._vaults_loaded_at):
+                self._vaults = loader()
+                self._vaults_by_name = {v.name: v for v in self._vaults}
+                self._vaults_loaded_at = time.monotonic()
+            return self._vaults
+
+    def by_name(self, loader, name: str) -> TimeSeries:
+        with self._lock:
+            self.timeseries(loader)
+            return self._by_name.get(name)
+
+    def by_id(self, loader, ts_id: int) -> TimeSeries:
+        with self._lock:
+            self.timeseries(loader)
+            return self._by_id.get(ts_id)
+
+    def by_vault(self, loader, vault_name: str) -> List[TimeSeries]:
+        with self._lock:
+            self.timeseries(loader)
+            return list(self._by_vault.get(vault_name, []))
+
+    def vault_by_name(self, loader, name: str) -> Vault:
+        with self._lock:
+            self.vaults(loader)
+            return self._vaults_by_name.get(name)
+
+    def invalidate(self):
+        with self._lock:
+            self._timeseries = None
+            self._vaults = None
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def split_range(from_dt: datetime, to_dt: datetime, chunk: Union[timedelta, relativedelta]) -> List[Tuple[datetime, datetime]]:
+    """Split [from_dt, to_dt) into consecutive half-open windows of at most `chunk`."""
+    ranges = []
+    start = from_dt
+    while start < to_dt:
+        end = min(start + chunk, to_dt)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def stitch_chunks(chunks: List[list]) -> list:
+    """Concatenate per-window datapoint lists, dropping a boundary point returned by two adjacent windows."""
+    result = []
+    for rows in chunks:
+        if result and rows and rows[0]["start"] == result[-1]["start"]:
+            rows = rows[1:]
+        result.extend(rows)
+    return result
+
+
+class EDWApiBase:
+    """
+    Configuration and (de)serialization shared by the blocking and the asyncio EDW clients.
+    """
+
+    def __init__(self, base_url: str = None, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None,
+                 chunk: Union[timedelta, relativedelta] = None):
         #self.base_url = "http://demo.amplifino.com:8080"
         #self.base_url = "http://10.64.88.197:8080"  # grafana.amplifino.com (vpn ip address)
         #self.base_url = "http://localhost:8080"
-        self.base_url = os.getenv("EDW_API_ENDPOINT", default="http://demo.amplifino.com:8080")
-
-    def get_vaults(self):
-        url = f"{self.base_url}/vaults"
-        response = requests.get(url)
-        results = response.json()
-        return self._json_to_vaults(results)
-
-    def get_timeseries(self):
-        url = f"{self.base_url}/timeseries"
-        response = requests.get(url)
-        results = response.json()
-        return self._json_to_timeseries(results)
-
-    def get_timeseries_by_name(self, name: str):
-        url = f"{self.base_url}/timeseries"
-        response = requests.get(url, params={"name": name})
-        results = response.json()
-        ts_list = self._json_to_timeseries(results)
-        return ts_list[0] if ts_list else None
+        self.base_url = base_url or os.getenv("EDW_API_ENDPOINT", default="http://demo.amplifino.com:8080")
+        self.pool_size = pool_size or int(os.getenv("EDW_API_POOL_SIZE", default="10"))
+        self.connect_timeout = connect_timeout or float(os.getenv("EDW_API_CONNECT_TIMEOUT", default="5"))
+        self.read_timeout = read_timeout or float(os.getenv("EDW_API_READ_TIMEOUT", default="120"))
+        # reads spanning more than one chunk are split and fetched concurrently
+        self.chunk = chunk or relativedelta(months=1)
+        # writes are posted in batches of at most batch_size points, write_workers of them in flight
+        self.batch_size = int(os.getenv("EDW_API_BATCH_SIZE", default="5000"))
+        self.write_workers = int(os.getenv("EDW_API_WRITE_WORKERS", default="4"))
+        self.compress = os.getenv("EDW_API_GZIP", default="false") == "true"
+        # float dtype of decoded value matrices, e.g. np.float32 halves the memory of wide vaults
+        self.dtype = np.float64
+
+    @property
+    def catalog(self) -> TimeSeriesCatalog:
+        """The catalog cache shared by every client of this endpoint."""
+        with _catalogs_lock:
+            if self.base_url not in _catalogs:
+                _catalogs[self.base_url] = TimeSeriesCatalog(ttl=float(os.getenv("EDW_API_CATALOG_TTL", default="300")))
+            return _catalogs[self.base_url]
 
     def _json_to_vaults(self, json: dict) -> List[Vault]:
         return [
@@ -122,58 +313,195 @@ class EDWApi:
     def isotime(self, dt):
         return dt.isoformat(timespec='seconds')
 
-
-    def store_datapoints(self, ts_id: int, datapoints: List[DataPoint]):
-        url = f"{self.base_url}/timeseries/{ts_id}/values"
+    def _datapoints_payload(self, datapoints: Union[List[DataPoint], DataPointBatch]):
+        if isinstance(datapoints, DataPointBatch):
+            starts = np.datetime_as_string(datapoints.times.astype("datetime64[s]"), unit="s", timezone="UTC").tolist()
+            return [{"start": start, "values": values} for start, values in zip(starts, datapoints.values.tolist())]
         if len(datapoints)>0 and not isinstance(datapoints[0].start, str):
-            data = [
+            return [
                 {
                     "start": self.isotime(dp.start),
                     "values": dp.values
                 } for dp in datapoints
             ]
-        else:
-            data = [
-                {
-                    "start": dp.start,
-                    "values": dp.values
-                } for dp in datapoints
-            ]
-        response = requests.post(url, json=data)
-        return response.json()
-
-    def store_dataframe(self, ts_id: int, df: pd.DataFrame, time_col:str, val_cols: Union[str, List[str]] = None):
-        url = f"{self.base_url}/timeseries/{ts_id}/values"
-        data = [
+        return [
             {
-                "start": self.isotime(row[time_col]),
-                "values": row[val_cols].tolist() if isinstance(val_cols, list) else [row[val_cols]]
-            } for _, row in df.iterrows()
+                "start": dp.start,
+                "values": dp.values
+            } for dp in datapoints
         ]
-        response = requests.post(url, json=data)
-        return response.json()
 
-    def get_datapoints(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime):
-        url = f"{self.base_url}/timeseries/{ts.id}/values"
-        response = requests.get(url, params={"from": self.isotime(from_dt), "to": self.isotime(to_dt)})
-        return response.json()
+    def isotimes(self, times) -> np.ndarray:
+        """Vectorized isotime() for a Series/array of datetimes. Aware times are rendered in UTC."""
+        times = pd.DatetimeIndex(times)
+        if times.tz is None:
+            return np.datetime_as_string(times.values.astype("datetime64[s]"), unit="s")
+        return np.datetime_as_string(times.tz_convert("UTC").tz_localize(None).values.astype("datetime64[s]"), unit="s", timezone="UTC")
+
+    def _dataframe_payload(self, df: pd.DataFrame, time_col: str, val_cols: Union[str, List[str]]):
+        starts = self.isotimes(df[time_col]).tolist()
+        values = df[val_cols if isinstance(val_cols, list) else [val_cols]].to_numpy().tolist()
+        return [{"start": start, "values": vals} for start, vals in zip(starts, values)]
+
+    def _split_batches(self, payload: list, batch_size: int = None) -> List[list]:
+        batch_size = batch_size or self.batch_size
+        return [payload[i:i + batch_size] for i in range(0, len(payload), batch_size)]
+
+    def _encode_batch(self, batch: list, compress: bool):
+        body = json.dumps(batch).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if compress:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+
+    def _datapoints_to_arrays(self, ts: TimeSeries, data, dtype=None):
+        return decode_datapoints(data, ts.fieldNames, dtype or self.dtype)
+
+    def _datapoints_to_df(self, ts: TimeSeries, data, dtype=None):
+        return datapoints_frame(*self._datapoints_to_arrays(ts, data, dtype))
+
+
+class EDWApi(EDWApiBase):
+    """
+    Blocking EDW client. All calls share one pooled keep-alive session, so consecutive requests
+    reuse the TCP/TLS connection instead of opening a new one per call.
+    """
+
+    def __init__(self, base_url: str = None, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None,
+                 chunk: Union[timedelta, relativedelta] = None):
+        super().__init__(base_url, pool_size, connect_timeout, read_timeout, chunk)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self.session = self._create_session()
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
 
-    def get_datapoints_as_df(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime):
-        url = f"{self.base_url}/timeseries/{ts.id}/values"
-        response = requests.get(url, params={"from": self.isotime(from_dt), "to": self.isotime(to_dt)})
-        data = response.json()
-        df = pd.DataFrame(data)
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _load_vaults(self):
+        url = f"{self.base_url}/vaults"
+        response = self.session.get(url, timeout=self.timeout)
+        results = response.json()
+        return self._json_to_vaults(results)
+
+    def _load_timeseries(self):
+        url = f"{self.base_url}/timeseries"
+        response = self.session.get(url, timeout=self.timeout)
+        results = response.json()
+        return self._json_to_timeseries(results)
+
+    def get_vaults(self, refresh=False):
+        return list(self.catalog.vaults(self._load_vaults, refresh=refresh))
 
-        # Split the 'values' list into separate columns
-        values_df = pd.DataFrame(df['values'].tolist(), columns=[x["name"] for x in ts.vault["recordSpec"]["fieldSpecs"]])
+    def get_timeseries(self, refresh=False):
+        return list(self.catalog.timeseries(self._load_timeseries, refresh=refresh))
 
-        # Combine the 'start' column with the values DataFrame
-        df = pd.concat([df['start'], values_df], axis=1)
+    def find_timeseries(self, name: str):
+        return self.catalog.by_name(self._load_timeseries, name)
 
-        # Convert 'start' to datetime (optional, for consistency)
-        df['start'] = pd.to_datetime(df['start'])
+    def find_timeseries_by_id(self, ts_id: int):
+        return self.catalog.by_id(self._load_timeseries, ts_id)
+
+    def find_timeseries_by_vault(self, vault_name: str):
+        return self.catalog.by_vault(self._load_timeseries, vault_name)
+
+    def find_vault(self, name: str):
+        return self.catalog.vault_by_name(self._load_vaults, name)
+
+    def invalidate_catalog(self):
+        self.catalog.invalidate()
+
+    def get_timeseries_by_name(self, name: str):
+        url = f"{self.base_url}/timeseries"
+        response = self.session.get(url, params={"name": name}, timeout=self.timeout)
+        results = response.json()
+        ts_list = self._json_to_timeseries(results)
+        return ts_list[0] if ts_list else None
+
+
+    def _post_batch(self, ts_id: int, index: int, batch: list, compress: bool) -> BatchResult:
+        url = f"{self.base_url}/timeseries/{ts_id}/values"
+        body, headers = self._encode_batch(batch, compress)
+        result = BatchResult(index=index, rows=len(batch), payload=batch)
+        try:
+            response = self.session.post(url, data=body, headers=headers, timeout=self.timeout)
+            result.status = response.status_code
+            if response.ok:
+                result.response = response.json() if response.content else None
+                result.payload = None
+            else:
+                result.error = response.text
+        except requests.RequestException as e:
+            result.error = str(e)
+        return result
+
+    def _post_batches(self, ts_id: int, batches: List[Tuple[int, list]], compress: bool = None, max_workers: int = None) -> List[BatchResult]:
+        compress = self.compress if compress is None else compress
+        max_workers = min(max_workers or self.write_workers, max(len(batches), 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda b: self._post_batch(ts_id, b[0], b[1], compress), batches))
+
+    def store_payload(self, ts_id: int, payload: list, batch_size: int = None, compress: bool = None, max_workers: int = None) -> List[BatchResult]:
+        """Post an already built list of {"start", "values"} dicts in bounded, optionally gzipped, parallel batches."""
+        batches = list(enumerate(self._split_batches(payload, batch_size)))
+        results = self._post_batches(ts_id, batches, compress, max_workers)
+        failed = [r for r in results if not r.ok]
+        if failed:
+            print(f"{len(failed)} of {len(results)} batches failed for timeseries {ts_id}")
+        return results
+
+    def store_datapoints(self, ts_id: int, datapoints: Union[List[DataPoint], DataPointBatch], batch_size: int = None, compress: bool = None, max_workers: int = None) -> List[BatchResult]:
+        data = self._datapoints_payload(datapoints)
+        return self.store_payload(ts_id, data, batch_size, compress, max_workers)
+
+    def store_dataframe(self, ts_id: int, df: pd.DataFrame, time_col:str, val_cols: Union[str, List[str]] = None,
+                        batch_size: int = None, compress: bool = None, max_workers: int = None) -> List[BatchResult]:
+        data = self._dataframe_payload(df, time_col, val_cols)
+        return self.store_payload(ts_id, data, batch_size, compress, max_workers)
+
+    def retry_failed(self, ts_id: int, results: List[BatchResult], compress: bool = None, max_workers: int = None) -> List[BatchResult]:
+        """Re-post only the failed batches of an earlier store call; successful results are kept as they are."""
+        retried = self._post_batches(ts_id, [(r.index, r.payload) for r in results if not r.ok], compress, max_workers)
+        retried = {r.index: r for r in retried}
+        return [retried.get(r.index, r) for r in results]
+
+    def _get_datapoints_range(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime):
+        url = f"{self.base_url}/timeseries/{ts.id}/values"
+        response = self.session.get(url, timeout=self.timeout, params={"from": self.isotime(from_dt), "to": self.isotime(to_dt)})
+        return response.json()
 
-        return df
+    def get_datapoints(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime, chunk: Union[timedelta, relativedelta] = None):
+        """
+        Fetch the datapoints in [from_dt, to_dt). Windows longer than `chunk` (default self.chunk)
+        are split, fetched in parallel over the session pool and stitched back in time order.
+        """
+        ranges = split_range(from_dt, to_dt, chunk or self.chunk)
+        if len(ranges) <= 1:
+            return self._get_datapoints_range(ts, from_dt, to_dt)
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(ranges))) as executor:
+            chunks = list(executor.map(lambda r: self._get_datapoints_range(ts, *r), ranges))
+        return stitch_chunks(chunks)
+
+    def get_datapoints_as_arrays(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime, chunk: Union[timedelta, relativedelta] = None, dtype=None):
+        """Fetch [from_dt, to_dt) as (epoch seconds, value matrix, field names)."""
+        data = self.get_datapoints(ts, from_dt, to_dt, chunk)
+        return self._datapoints_to_arrays(ts, data, dtype)
+
+    def get_datapoints_as_df(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime, chunk: Union[timedelta, relativedelta] = None, dtype=None):
+        data = self.get_datapoints(ts, from_dt, to_dt, chunk)
+        return self._datapoints_to_df(ts, data, dtype)
 
     def create_timeseries(self, ts_name: str, vault_name: str, period: str, customer: str, cluster: str, kind: str, section: str):
         url = f"{self.base_url}/timeseries"
@@ -186,12 +514,13 @@ class EDWApi:
             "kind": kind,
             "section": section
         }
-        response = requests.post(url, json=data)
+        response = self.session.post(url, json=data, timeout=self.timeout)
+        self.invalidate_catalog()
         return response.json()
 
     def create_recordspec(self, name:str, field_specs: List[FieldSpec]):
         url = f"{self.base_url}/recordspecs"
-        return requests.post(url, json={"name": name, "fieldSpecs": field_specs}).json()
+        return self.session.post(url, json={"name": name, "fieldSpecs": field_specs}, timeout=self.timeout).json()
 
     def create_vault(self, name: str, recordspec_name: int, partitioned: bool = False, zone_id: str = "Europe/Brussels"):
         url = f"{self.base_url}/vaults"
@@ -201,7 +530,8 @@ class EDWApi:
             "partitioned": partitioned,
             "zoneId": zone_id
         }
-        response = requests.post(url, json=data)
+        response = self.session.post(url, json=data, timeout=self.timeout)
+        self.invalidate_catalog()
         return response.json()
 
 
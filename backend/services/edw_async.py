@@ -0,0 +1,97 @@
+import asyncio
+import os
+import aiohttp
+from datetime import datetime, timedelta
+from typing import List, Union
+from dateutil.relativedelta import relativedelta
+
+from backend.services.edw import EDWApiBase, DataPoint, DataPointBatch, TimeSeries, BatchResult, split_range, stitch_chunks
+
+
+class AsyncEDWApi(EDWApiBase):
+    """
+    asyncio variant of EDWApi with the same read/write surface. Requests share one pooled
+    aiohttp session and at most `concurrency` of them are in flight at any time, so callers
+    can asyncio.gather() over many series without flooding the EDW endpoint.
+
+    usage:
+        async with AsyncEDWApi() as api:
+            frames = await asyncio.gather(*[api.get_datapoints_as_df(ts, fromdt, todt) for ts in series])
+    """
+
+    def __init__(self, base_url: str = None, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None,
+                 chunk: Union[timedelta, relativedelta] = None, concurrency: int = None):
+        super().__init__(base_url, pool_size, connect_timeout, read_timeout, chunk)
+        self.concurrency = concurrency or int(os.getenv("EDW_API_CONCURRENCY", default=str(self.pool_size)))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _get_json(self, url, params=None):
+        async with self._semaphore:
+            async with self.session.get(url, params=params) as response:
+                return await response.json()
+
+    async def get_timeseries(self):
+        results = await self._get_json(f"{self.base_url}/timeseries")
+        return self._json_to_timeseries(results)
+
+    async def _get_datapoints_range(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime):
+        url = f"{self.base_url}/timeseries/{ts.id}/values"
+        return await self._get_json(url, params={"from": self.isotime(from_dt), "to": self.isotime(to_dt)})
+
+    async def get_datapoints(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime, chunk: Union[timedelta, relativedelta] = None):
+        ranges = split_range(from_dt, to_dt, chunk or self.chunk)
+        if len(ranges) <= 1:
+            return await self._get_datapoints_range(ts, from_dt, to_dt)
+        chunks = await asyncio.gather(*[self._get_datapoints_range(ts, *r) for r in ranges])
+        return stitch_chunks(chunks)
+
+    async def get_datapoints_as_arrays(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime, chunk: Union[timedelta, relativedelta] = None, dtype=None):
+        data = await self.get_datapoints(ts, from_dt, to_dt, chunk)
+        return self._datapoints_to_arrays(ts, data, dtype)
+
+    async def get_datapoints_as_df(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime, chunk: Union[timedelta, relativedelta] = None, dtype=None):
+        data = await self.get_datapoints(ts, from_dt, to_dt, chunk)
+        return self._datapoints_to_df(ts, data, dtype)
+
+    async def _post_batch(self, ts_id: int, index: int, batch: list, compress: bool) -> BatchResult:
+        url = f"{self.base_url}/timeseries/{ts_id}/values"
+        body, headers = self._encode_batch(batch, compress)
+        result = BatchResult(index=index, rows=len(batch), payload=batch)
+        try:
+            async with self._semaphore:
+                async with self.session.post(url, data=body, headers=headers) as response:
+                    result.status = response.status
+                    if response.ok:
+                        result.response = await response.json(content_type=None)
+                        result.payload = None
+                    else:
+                        result.error = await response.text()
+        except aiohttp.ClientError as e:
+            result.error = str(e)
+        return result
+
+    async def store_datapoints(self, ts_id: int, datapoints: Union[List[DataPoint], DataPointBatch], batch_size: int = None, compress: bool = None) -> List[BatchResult]:
+        compress = self.compress if compress is None else compress
+        batches = self._split_batches(self._datapoints_payload(datapoints), batch_size)
+        return await asyncio.gather(*[self._post_batch(ts_id, i, batch, compress) for i, batch in enumerate(batches)])
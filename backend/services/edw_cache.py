@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Union
+
+from backend.services.edw import EDWApi, TimeSeries
+
+CACHE_FOLDER = os.path.join("data", "edw_cache")  # Folder holding the parquet partitions
+
+
+def _utc(dt) -> pd.Timestamp:
+    """dt as a UTC Timestamp; naive datetimes are taken as UTC, like DataPointBatch.from_dataframe does."""
+    ts = pd.Timestamp(dt)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+
+class EDWSeriesCache:
+    """
+    Read-through, month-partitioned parquet cache of EDW series.
+
+    Layout: <folder>/<tsid>/<YYYY-MM>.parquet (UTC months) plus a manifest.json per series holding,
+    for every cached month, the high-water mark (start of the last cached point) and whether the
+    month is complete. A month is complete once TimeSeries.lastTime is past its end; complete months
+    are served locally, open months are topped up from their high-water mark only.
+
+    A backfill that rewrites history must invalidate() the affected series or month.
+    """
+
+    def __init__(self, edw_api: EDWApi = None, folder: str = None, max_bytes: int = None, max_age: timedelta = None):
+        self.edw_api = edw_api or EDWApi()
+        self.folder = folder or os.getenv("EDW_CACHE_FOLDER", default=CACHE_FOLDER)
+        self.max_bytes = max_bytes or int(os.getenv("EDW_CACHE_MAX_BYTES", default=str(2 * 1024 ** 3)))
+        self.max_age = max_age or timedelta(days=int(os.getenv("EDW_CACHE_MAX_AGE_DAYS", default="90")))
+        self._lock = threading.RLock()
+
+    def _series_folder(self, ts_id: int):
+        return os.path.join(self.folder, str(ts_id))
+
+    def _month_file(self, ts_id: int, month: str):
+        return os.path.join(self._series_folder(ts_id), f"{month}.parquet")
+
+    def _load_manifest(self, ts_id: int) -> dict:
+        path = os.path.join(self._series_folder(ts_id), "manifest.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_manifest(self, ts_id: int, manifest: dict):
+        os.makedirs(self._series_folder(ts_id), exist_ok=True)
+        path = os.path.join(self._series_folder(ts_id), "manifest.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _read_month(self, ts_id: int, month: str):
+        path = self._month_file(ts_id, month)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)  # eviction is least-recently-used
+        df = pd.read_parquet(path)
+        df["start"] = df["start"].dt.as_unit("ns")
+        return df
+
+    @staticmethod
+    def _month_starts(from_dt: datetime, to_dt: datetime):
+        first = _utc(from_dt).replace(day=1, hour=0, minute=0, second=0, microsecond=0, nanosecond=0)
+        return list(pd.date_range(first, _utc(to_dt), freq="MS", inclusive="left")) or [first]
+
+    def _fetch(self, ts: TimeSeries, task):
+        month, fetch_from, fetch_to, cached = task
+        fresh = self.edw_api.get_datapoints_as_df(ts, fetch_from.to_pydatetime(), fetch_to.to_pydatetime())
+        if cached is not None:
+            fresh = pd.concat([cached, fresh], ignore_index=True).drop_duplicates("start", keep="last").sort_values("start", ignore_index=True)
+        return month, fetch_from, fetch_to, fresh
+
+    def get_datapoints_as_df(self, ts: TimeSeries, from_dt: datetime, to_dt: datetime) -> pd.DataFrame:
+        """Same result as EDWApi.get_datapoints_as_df, served from the cache where possible."""
+        last_time = _utc(ts.lastTime) if ts.lastTime is not None else None
+        with self._lock:
+            manifest = self._load_manifest(ts.id)
+            frames = {}
+            tasks = []
+            for month_start in self._month_starts(from_dt, to_dt):
+                month = month_start.strftime("%Y-%m")
+                month_end = month_start + pd.offsets.MonthBegin(1)
+                entry = manifest.get(month)
+                cached = self._read_month(ts.id, month) if entry else None
+                if cached is None:
+                    tasks.append((month, month_start, month_end, None))
+                    continue
+                hwm = pd.Timestamp(entry["hwm"], unit="s", tz="UTC")
+                if entry["complete"] or (last_time is not None and last_time <= hwm):
+                    frames[month] = cached
+                else:
+                    tasks.append((month, hwm, month_end, cached))
+
+            if tasks:
+                with ThreadPoolExecutor(max_workers=min(self.edw_api.pool_size, len(tasks))) as executor:
+                    fetched = list(executor.map(lambda t: self._fetch(ts, t), tasks))
+                os.makedirs(self._series_folder(ts.id), exist_ok=True)
+                for month, fetch_from, month_end, df in fetched:
+                    df.to_parquet(self._month_file(ts.id, month), index=False)
+                    hwm = df["start"].iloc[-1] if len(df) else fetch_from
+                    manifest[month] = {
+                        "hwm": int(hwm.timestamp()),
+                        "complete": bool(last_time is not None and last_time >= month_end),
+                    }
+                    frames[month] = df
+                self._save_manifest(ts.id, manifest)
+
+        if tasks:
+            self.evict()
+        df = pd.concat([frames[m] for m in sorted(frames)], ignore_index=True)
+        start = df["start"]
+        return df[(start >= _utc(from_dt)) & (start < _utc(to_dt))].reset_index(drop=True)
+
+    def invalidate(self, ts_id: int, month: Union[str, datetime] = None):
+        """Drop one month ("YYYY-MM" or any datetime in it, UTC) or the whole series from the cache."""
+        with self._lock:
+            if month is None:
+                shutil.rmtree(self._series_folder(ts_id), ignore_errors=True)
+                return
+            if not isinstance(month, str):
+                month = _utc(month).strftime("%Y-%m")
+            manifest = self._load_manifest(ts_id)
+            manifest.pop(month, None)
+            self._save_manifest(ts_id, manifest)
+            if os.path.exists(self._month_file(ts_id, month)):
+                os.remove(self._month_file(ts_id, month))
+
+    def evict(self):
+        """Remove partitions not read for max_age, then the least recently used ones until under max_bytes."""
+        with self._lock:
+            if not os.path.isdir(self.folder):
+                return
+            files = []
+            for ts_id in os.listdir(self.folder):
+                if not os.path.isdir(self._series_folder(ts_id)):
+                    continue  # stray files next to the series folders
+                for name in os.listdir(self._series_folder(ts_id)):
+                    if name.endswith(".parquet"):
+                        stat = os.stat(os.path.join(self._series_folder(ts_id), name))
+                        files.append((stat.st_mtime, stat.st_size, ts_id, name[:-len(".parquet")]))
+            files.sort()
+            total = sum(f[1] for f in files)
+            oldest_allowed = datetime.now().timestamp() - self.max_age.total_seconds()
+            for mtime, size, ts_id, month in files:
+                if mtime >= oldest_allowed and total <= self.max_bytes:
+                    break
+                self.invalidate(ts_id, month)
+                total -= size
@@ -4,12 +4,28 @@ import pytz
 import requests
 import base64
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from backend.services.edw import DataPoint, TimeSeries, EDWApi
+from backend.services.edw import DataPoint, DataPointBatch, TimeSeries, EDWApi
+from backend.services.siterunner import SiteRunner
+from backend.services.checkpoint import CheckpointStore
+from backend.services.gaps import GapScanner
+from backend.services.fingerprint import ChangeOnlyWriter
 
 SITE_IDS = [341,342,343,307,332,400] # kiosun
 
+# /box_data endpoints combined by get_site_data: (method, response key, columns to drop, columns to rename)
+BOX_DATA_ENDPOINTS = [
+    ("/box_data/grid_metering_box", "GRID_DATA", [], {}),
+    ("/box_data/total_consumption", "CONSUMPTION_DATA", ["CONSUMPTION_CUMULATIVE"], {}),
+    ("/box_data/total_production", "PRODUCTION_DATA", ["PRODUCTION_CUMULATIVE"], {}),
+    ("/box_data/curtailed_production", "PRODUCTION_DATA", ["PRODUCTION_CUMULATIVE"], {"PRODUCTION": "CURTAILED_PRODUCTION"}),
+    ("/box_data/uncurtailed_production", "PRODUCTION_DATA", ["PRODUCTION_CUMULATIVE"], {"PRODUCTION": "UNCURTAILED_PRODUCTION"}),
+    ("/box_data/charge_discharge", "FLEX_DATA", [], {}),
+]
+
 load_dotenv()
 
 class Elion:
@@ -18,6 +34,15 @@ class Elion:
         self.token = self.get_token()
         self.site_ids = site_ids
         self.edw_api = EDWApi()
+        # number of sites fetched at once
+        self.workers = int(os.getenv("INGEST_WORKERS", default="4"))
+        self.gap_scanner = GapScanner(self.edw_api)
+        self.writer = ChangeOnlyWriter(self.edw_api)
+        # window scanned for missing quarter-hours on every run
+        self.lookback = timedelta(days=int(os.getenv("ELION_LOOKBACK_DAYS", default="30")))
+        self.checkpoints = CheckpointStore("elion")
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=(len(BOX_DATA_ENDPOINTS) + 1) * self.workers))
 
     def get_token(self):
 
@@ -49,7 +74,7 @@ class Elion:
             "Authorization": f"Bearer {token}",
         }
 
-        response = requests.get(url, headers=headers, params=params)
+        response = self.session.get(url, headers=headers, params=params)
 
         if response.status_code == 200:
             return response.json()
@@ -69,150 +94,138 @@ class Elion:
 
         body = data
 
-        response = requests.post(url, headers=headers, params=params, json=body)
+        response = self.session.post(url, headers=headers, params=params, json=body)
         return response
 
-    def get_site_data(self, site_id, fromutc: datetime, touc: datetime):
-        fromutc_str = fromutc.strftime("%Y-%m-%d %H:%M")
-        toutc_str = touc.strftime("%Y-%m-%d %H:%M")
-        grid_data = pd.DataFrame(self.get_data(self.token, "/box_data/grid_metering_box", {
-            "fromutc": fromutc_str,
-            "touc": toutc_str,
-            "time_format": "%Y-%m-%d %H:%M",
-            "site_id": site_id,
-            #"granularity": "15"??
-        })["GRID_DATA"])
-        grid_data["UTCTIME"] = pd.to_datetime(grid_data["UTCTIME"])
-
-        cons_data = pd.DataFrame(self.get_data(self.token, "/box_data/total_consumption", {
-            "fromutc": fromutc_str,
-            "touc": toutc_str,
-            "time_format": "%Y-%m-%d %H:%M",
-            "site_id": site_id,
-        })["CONSUMPTION_DATA"])
-        cons_data["UTCTIME"] = pd.to_datetime(cons_data["UTCTIME"])
-        cons_data = cons_data.drop(columns=['CONSUMPTION_CUMULATIVE'])
-
-
-        prod_data = pd.DataFrame(self.get_data(self.token, "/box_data/total_production", {
-            "fromutc": fromutc_str,
-            "touc": toutc_str,
-            "time_format": "%Y-%m-%d %H:%M",
-            "site_id": site_id,
-        })["PRODUCTION_DATA"])
-        prod_data["UTCTIME"] = pd.to_datetime(prod_data["UTCTIME"])
-        prod_data = prod_data.drop(columns=['PRODUCTION_CUMULATIVE'])
-
-        prod_curt_data = pd.DataFrame(self.get_data(self.token, "/box_data/curtailed_production", {
-            "fromutc": fromutc_str,
-            "touc": toutc_str,
-            "time_format": "%Y-%m-%d %H:%M",
-            "site_id": site_id,
-        })["PRODUCTION_DATA"])
-        prod_curt_data["UTCTIME"] = pd.to_datetime(prod_curt_data["UTCTIME"])
-        prod_curt_data = prod_curt_data.rename(columns={"PRODUCTION": "CURTAILED_PRODUCTION"})
-        prod_curt_data = prod_curt_data.drop(columns=['PRODUCTION_CUMULATIVE'])
-
-        prod_uncurt_data = pd.DataFrame(self.get_data(self.token, "/box_data/uncurtailed_production", {
-            "fromutc": fromutc_str,
-            "touc": toutc_str,
-            "time_format": "%Y-%m-%d %H:%M",
-            "site_id": site_id,
-        })["PRODUCTION_DATA"])
-        prod_uncurt_data["UTCTIME"] = pd.to_datetime(prod_uncurt_data["UTCTIME"])
-        prod_uncurt_data = prod_uncurt_data.rename(columns={"PRODUCTION": "UNCURTAILED_PRODUCTION"})
-        prod_uncurt_data = prod_uncurt_data.drop(columns=['PRODUCTION_CUMULATIVE'])
-
-        flex_data = pd.DataFrame(self.get_data(self.token, "/box_data/charge_discharge", {
-            "fromutc": fromutc_str,
-            "touc": toutc_str,
-            "time_format": "%Y-%m-%d %H:%M",
-            "site_id": site_id,
-        })["FLEX_DATA"])
-        flex_data["UTCTIME"] = pd.to_datetime(flex_data["UTCTIME"])
-
+    def _get_soc_data(self, site_id, params):
         try:
-            soc_data = pd.DataFrame(self.get_data(self.token, "/box_data/soc", {
+            soc_data = pd.DataFrame(self.get_data(self.token, "/box_data/soc", dict(params, **{
                 "fromutc": "2025-01-01 00:00",
                 "touc": "2025-01-02 00:00",
-                "time_format": "%Y-%m-%d %H:%M",
-                "site_id": site_id,
-            })["SOC_DATA"])
+            }))["SOC_DATA"])
             soc_data["UTCTIME"] = pd.to_datetime(soc_data["UTCTIME"])
+            return soc_data.set_index("UTCTIME")
         except BaseException as e:
             print("SOC data not found")
-            soc_data = None
+            return None
+
+    def get_site_data(self, site_id, fromutc: datetime, touc: datetime):
+        """
+        Fetch all /box_data endpoints of a site concurrently and combine them on UTCTIME,
+        aggregated to 15-minute intervals (SOC keeps the last value, everything else is summed).
+        """
+        params = {
+            "fromutc": fromutc.strftime("%Y-%m-%d %H:%M"),
+            "touc": touc.strftime("%Y-%m-%d %H:%M"),
+            "time_format": "%Y-%m-%d %H:%M",
+            "site_id": site_id,
+            #"granularity": "15"??
+        }
+
+        with ThreadPoolExecutor(max_workers=len(BOX_DATA_ENDPOINTS) + 1) as executor:
+            soc_future = executor.submit(self._get_soc_data, site_id, params)
+            responses = list(executor.map(lambda endpoint: self.get_data(self.token, endpoint[0], params), BOX_DATA_ENDPOINTS))
+            soc_data = soc_future.result()
 
-        df = pd.merge(grid_data, cons_data, on="UTCTIME")
-        df = pd.merge(df, prod_data, on="UTCTIME")
-        df = pd.merge(df, prod_curt_data, on="UTCTIME")
-        df = pd.merge(df, prod_uncurt_data, on="UTCTIME")
-        df = pd.merge(df, flex_data, on="UTCTIME")
+        frames = []
+        for (method, key, drop_cols, rename_cols), response in zip(BOX_DATA_ENDPOINTS, responses):
+            frame = pd.DataFrame(response[key]) if response[key] else pd.DataFrame(columns=["UTCTIME"])
+            frame["UTCTIME"] = pd.to_datetime(frame["UTCTIME"])
+            frames.append(frame.set_index("UTCTIME").drop(columns=drop_cols, errors="ignore").rename(columns=rename_cols))
         if soc_data is not None:
-            df = pd.merge(df, soc_data, on="UTCTIME")
-        else:
-            df["SOC"] = 0.0
+            frames.append(soc_data)
 
-        # Convert UTCTIME to 15-minute intervals
-        df["UTCTIME"] = df["UTCTIME"].dt.floor("15min")
+        # one inner-join alignment on the common time index instead of a chain of merges; concat cannot
+        # align a duplicated UTCTIME, so an endpoint repeating a timestamp keeps its last value
+        frames = [frame[~frame.index.duplicated(keep="last")] for frame in frames]
+        df = pd.concat(frames, axis=1, join="inner")
+        if soc_data is None:
+            df["SOC"] = 0.0
 
-        agg_rules = {col: "sum" for col in df.columns if col not in ["UTCTIME", "SOC"]}
+        agg_rules = {col: "sum" for col in df.columns if col != "SOC"}
         agg_rules["SOC"] = "last"  # Keep last value of SOC in each 15-minute interval
 
-        df_agg = df.groupby("UTCTIME").agg(agg_rules).reset_index()
-
-        df_agg["UTCTIME"] = df_agg["UTCTIME"].dt.tz_localize("UTC")
+        # Convert UTCTIME to 15-minute intervals
+        df_agg = df.groupby(df.index.floor("15min")).agg(agg_rules)
+        df_agg.index = df_agg.index.tz_localize("UTC")
+        df_agg.index.name = "UTCTIME"
 
-        return df_agg
+        return df_agg.reset_index()
 
     def create_timeseries(self, site_id):
-        timeseries = self.edw_api.get_timeseries()
-        ts = next(filter(lambda x: x.name == f"elion/{site_id}", timeseries), None)
+        ts = self.edw_api.find_timeseries(f"elion/{site_id}")
         if not ts:
             res = self.edw_api.create_timeseries (f"elion/{site_id}", "elion","PT15M", None, None, None, None)
             print("created timeseries", res)
             return res
 
     def find_or_create_timeseries(self, site_id):
-        timeseries = self.edw_api.get_timeseries()
-        ts = next(filter(lambda x: x.name == f"elion/{site_id}", timeseries), None)
+        ts = self.edw_api.find_timeseries(f"elion/{site_id}")
         if ts:
             return ts
         else:
             print(f"Timeseries for site {site_id} not found, creating...")
-            ts_json = self.create_timeseries(site_id)
-            ts_json["firstTime"] = None
-            ts_json["lastTime"] = None
-            return TimeSeries(**ts_json)
+            self.create_timeseries(site_id)
+            # create_timeseries invalidated the catalog, so this reloads it once
+            return self.edw_api.find_timeseries(f"elion/{site_id}")
 
 
     def store_data(self, ts, df):
-        insert_data = [
-            DataPoint(
-                start= row["UTCTIME"],
-                values= [row['GRID_OFFTAKE'] ,
-                         row['GRID_INJECT'] ,
-                            row['CONSUMPTION'],
-                            row['PRODUCTION'] ,
-                            row['CURTAILED_PRODUCTION'] ,
-                            row['UNCURTAILED_PRODUCTION'] ,
-                            row['FLEX_CHARGE'] ,
-                            row['FLEX_DISCHARGE'] ,
-                            row['SOC']])
-            for _, row in df.iterrows()
-        ]
-        self.edw_api.store_datapoints(ts.id, insert_data)
-
-    def run(self):
-        fromutc = datetime.now(pytz.UTC)-timedelta(days=30)
+        insert_data = DataPointBatch.from_dataframe(df, "UTCTIME", ['GRID_OFFTAKE',
+                                                                    'GRID_INJECT',
+                                                                    'CONSUMPTION',
+                                                                    'PRODUCTION',
+                                                                    'CURTAILED_PRODUCTION',
+                                                                    'UNCURTAILED_PRODUCTION',
+                                                                    'FLEX_CHARGE',
+                                                                    'FLEX_DISCHARGE',
+                                                                    'SOC'])
+        return self.writer.store(ts, insert_data)
+
+    def _fetch_site(self, site_id, fromutc, toutc):
+        """
+        Fetch only the intervals the site's series is missing between fromutc and toutc. The scan starts
+        no later than half an hour before the series' lastTime, so an outage longer than the lookback is
+        still caught up; the lookback only adds coverage for holes before that.
+        """
+        ts = self.find_or_create_timeseries(site_id)
+        if ts.lastTime is not None:
+            fromutc = min(fromutc, ts.lastTime - timedelta(minutes=30))
+        gaps = self.gap_scanner.scan(ts, fromutc, toutc)
+        print(f"Fetching {len(gaps)} missing intervals for site {site_id} between {fromutc} and {toutc}")
+        frames = []
+        for start, end in gaps:
+            df = self.get_site_data(site_id, start, end)
+            if df is None:
+                return ts, None
+            if not df.empty:
+                # a partially covered boundary quarter-hour would overwrite the complete stored one
+                times = pd.to_datetime(df["UTCTIME"], utc=True)
+                df = df[(times >= start) & (times < end)]
+            frames.append(df)
+        return ts, pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def backfill(self, site_id, fromutc, toutc, window=None):
+        """Ingest [fromutc, toutc) window by window, resuming from the site's checkpoint."""
+        ts = self.find_or_create_timeseries(site_id)
+        if ts.lastTime is not None:
+            fromutc = ts.lastTime - timedelta(minutes=30)
+        print(f"Backfilling site {site_id} from {fromutc} to {toutc}")
+        return SiteRunner.backfill(site_id, fromutc, toutc,
+                                   fetch=self.get_site_data,
+                                   store=lambda df: self.store_data(ts, df),
+                                   checkpoints=self.checkpoints, window=window)
+
+    def run(self, backfill=False):
+        fromutc = datetime.now(pytz.UTC)-self.lookback
         toutc = datetime.now(pytz.UTC)
-        for site_id in self.site_ids:
-            ts = self.find_or_create_timeseries(site_id)
-            if ts.lastTime is not None:
-                fromutc = ts.lastTime - timedelta(minutes=30)
-            print(f"Fetching data for site {site_id} from {fromutc} to {toutc}")
-            df = self.get_site_data(site_id, fromutc, toutc)
-            self.store_data(ts, df)
+        if backfill:
+            return SiteRunner(self.workers).run_each(self.site_ids, lambda site_id: self.backfill(site_id, fromutc, toutc))
+        return SiteRunner(self.workers).run(
+            self.site_ids,
+            fetch=lambda site_id: self._fetch_site(site_id, fromutc, toutc),
+            store=lambda site_id, ts, df: self.store_data(ts, df),
+        )
 
 if __name__ == "__main__":
     elion = Elion()
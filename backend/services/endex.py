@@ -2,52 +2,112 @@ import pdfplumber
 import pandas as pd
 import re
 import os
+import json
+import hashlib
 import requests
 import numpy as np
 import pytz
 
+from concurrent.futures import ProcessPoolExecutor
+
 from backend.database.MySQLDatabase import MySQLDatabase
 from backend.core.timeseriesprice import TimeSeriesPriceRepository
-from backend.services.edw import DataPoint, TimeSeries, EDWApi
+from backend.services.edw import DataPoint, DataPointBatch, TimeSeries, EDWApi
+from backend.services.fingerprint import ChangeOnlyWriter
 
 from datetime import datetime
 
 DATA_FOLDER = "data"  # Folder to save downloaded PDF file
+STATE_FILE = "endex_state.json"  # Validators and values of the last successful parse
+
+
+def _extract_pages(pdf_file, page_numbers):
+    """Extract the text of the given pages. Runs in a worker process, so it opens the PDF itself."""
+    with pdfplumber.open(pdf_file) as pdf:
+        return [pdf.pages[i].extract_text() or "" for i in page_numbers]
+
 
 class EndexDownloader:
 
     def __init__(self):
         self.database = MySQLDatabase.instance()
         self.edw_api = EDWApi()
-
-    def download_pdf(self, url, pdf_file):
-        """Download the PDF file from the URL to the local path."""
+        self.writer = ChangeOnlyWriter(self.edw_api)
+        self.parse_workers = int(os.getenv("ENDEX_PARSE_WORKERS", default=str(os.cpu_count() or 1)))
+        self.state_file = os.path.join(DATA_FOLDER, STATE_FILE)
+
+    def load_state(self) -> dict:
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def save_state(self, state: dict):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(self.state_file + ".tmp", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+    def download_pdf(self, url, pdf_file, state=None):
+        """
+        Download the PDF file from the URL to the local path, conditionally on the ETag/Last-Modified
+        and content hash in state. Returns the new validators when the file changed, None when it is
+        unchanged and False on error. The local file is only replaced when the content changed.
+        """
+        state = state or {}
         try:
 
             # Download the file
             headers = {"User-Agent": "Mozilla/5.0"}  # Mimic a browser to avoid blocks
+            if os.path.exists(pdf_file):
+                if state.get("etag"):
+                    headers["If-None-Match"] = state["etag"]
+                if state.get("last_modified"):
+                    headers["If-Modified-Since"] = state["last_modified"]
             response = requests.get(url, headers=headers, stream=True)
+            if response.status_code == 304:
+                print(f"PDF not modified since {state.get('last_modified') or state.get('etag')}")
+                return None
             response.raise_for_status()  # Check for HTTP errors
 
-            # Save the file
-            with open(pdf_file, "wb") as f:
+            # Save the file, hashing it on the way, the server does not always send validators
+            sha256 = hashlib.sha256()
+            with open(pdf_file + ".tmp", "wb") as f:
                 for chunk in response.iter_content(chunk_size=8192):
                     if chunk:
+                        sha256.update(chunk)
                         f.write(chunk)
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "sha256": sha256.hexdigest(),
+            }
+            if validators["sha256"] == state.get("sha256") and os.path.exists(pdf_file):
+                os.remove(pdf_file + ".tmp")
+                print("PDF content unchanged")
+                # keep the fresh validators so the next run can use a conditional request
+                self.save_state(dict(state, etag=validators["etag"], last_modified=validators["last_modified"]))
+                return None
+            os.replace(pdf_file + ".tmp", pdf_file)
             print(f"PDF downloaded successfully to {pdf_file}")
-            return True
+            return validators
         except requests.RequestException as e:
             print(f"Error downloading PDF: {e}")
             return False
 
     def extract_text_from_pdf(self, pdf_file):
-        """Extract text from all pages of a PDF file."""
+        """Extract text from all pages of a PDF file, with the pages spread over a process pool."""
         try:
             with pdfplumber.open(pdf_file) as pdf:
-                full_text = ""
-                for page in pdf.pages:
-                    full_text += page.extract_text() + "\n"
-            return full_text
+                page_count = len(pdf.pages)
+            workers = max(1, min(self.parse_workers, page_count))
+            if workers == 1:
+                return "\n".join(_extract_pages(pdf_file, range(page_count))) + "\n"
+            # contiguous page ranges per worker keep the page order when joining
+            ranges = [list(r) for r in np.array_split(np.arange(page_count), workers)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                texts = executor.map(_extract_pages, [pdf_file] * workers, ranges)
+                return "\n".join(text for pages in texts for text in pages) + "\n"
         except Exception as e:
             print(f"Error reading PDF: {e}")
             return None
@@ -87,75 +147,80 @@ class EndexDownloader:
         df = pd.DataFrame(data)
         return df
 
+    @staticmethod
+    def month_values(df) -> dict:
+        """Parsed quotations keyed by month, in the form kept in the state file."""
+        if df.empty:
+            return {}
+        return {
+            month.strftime("%Y-%m"): [float(v101), float(v103)]
+            for month, v101, v103 in zip(df["Month"], df["Endex101"], df["Endex103"])
+        }
+
+    def changed_months(self, df, state):
+        """
+        Rows of df whose month is new or whose values differ from the last parse. A month parsed more
+        than once (repeated on another page) keeps its last row, as in month_values.
+        """
+        if df.empty:
+            return df
+        df = df.drop_duplicates("Month", keep="last")
+        previous = state.get("months", {})
+        current = self.month_values(df)
+        changed = [previous.get(month) != current[month] for month in df["Month"].dt.strftime("%Y-%m")]
+        return df[changed]
 
-    def save_to_database(self, df):
-
-        df.set_index('Month', inplace=True)
-
-        # Step 2: Expand to 15-minute intervals with repeated values
 
-        start_date = df.index.min()
-        end_date = df.index.max() + pd.offsets.MonthEnd(0) + pd.Timedelta(days=1) - pd.Timedelta(minutes=15) # Full last month
-        time_range = pd.date_range(start=start_date, end=end_date, freq='15min', tz='Europe/Brussels')
-        df_15min = df.reindex(time_range).ffill()
-        df_15min.reset_index(inplace=True)
-        df_15min.rename(columns={'index': 'Timestamp'}, inplace=True)
-        df_15min["UTCTIME"] = df_15min["Timestamp"].dt.tz_convert('UTC')
+    def save_to_database(self, df):
+        """
+        Store the monthly Endex quotations at their native resolution: one point per month, at the
+        local (Europe/Brussels) month start. Quarter-hour views are expanded on read, see
+        TimeSeriesPriceRepository.find_expanded_between_as_df. Returns the batch results of both series.
+        """
+        df = df.copy()
+        df["UTCTIME"] = df["Month"].dt.tz_convert('UTC')
 
         # For Endex101
 
         ts_endex101 = self.find_or_create_timeseries("101")
 
-        insert_data_101 = [
-            DataPoint(
-                start= row["UTCTIME"],
-                values= [row['Endex101'] ]
-            )
-            for _, row in df_15min.iterrows()
-        ]
+        insert_data_101 = DataPointBatch.from_dataframe(df, "UTCTIME", "Endex101")
 
-        self.edw_api.store_datapoints(ts_endex101.id, insert_data_101)
+        results = self.writer.store(ts_endex101, insert_data_101)
 
         # For Endex103
 
         ts_endex103 = self.find_or_create_timeseries("103")
 
-        self.edw_api.store_datapoints(ts_endex101.id, insert_data_101)
+        insert_data_103 = DataPointBatch.from_dataframe(df, "UTCTIME", "Endex103")
 
-        insert_data_103 = [
-            DataPoint(
-                start=row["UTCTIME"],
-                values=[row['Endex103']]
-            )
-            for _, row in df_15min.iterrows()
-        ]
+        results += self.writer.store(ts_endex103, insert_data_103)
 
-        self.edw_api.store_datapoints(ts_endex103.id, insert_data_103)
-
-        print("Data successfully saved to ts_prices table.")
+        failed = [r for r in results if not r.ok]
+        if failed:
+            print(f"{len(failed)} of {len(results)} batches failed to store: {failed[0].error}")
+        else:
+            print("Data successfully saved to ts_prices table.")
+        return results
 
 
     def create_timeseries(self, ts_name):
-        timeseries = self.edw_api.get_timeseries()
-
-        ts = next(filter(lambda x: x.name == ts_name, timeseries), None)
+        ts = self.edw_api.find_timeseries(ts_name)
         if not ts:
-            res = self.edw_api.create_timeseries(ts_name, "prices", "PT15M", None, None, None, None)
+            res = self.edw_api.create_timeseries(ts_name, "prices", "P1M", None, None, None, None)
             print("created timeseries", res)
             return res
 
     def find_or_create_timeseries(self, endex_code: str):
-        timeseries = self.edw_api.get_timeseries()
-        ts_name = f"endex/{endex_code}/15"
-        ts = next(filter(lambda x: x.name == ts_name, timeseries), None)
+        ts_name = f"endex/{endex_code}/M"
+        ts = self.edw_api.find_timeseries(ts_name)
         if ts:
             return ts
         else:
             print(f"Timeseries for endex {endex_code} not found, creating...")
-            ts_json = self.create_timeseries(ts_name)
-            ts_json["firstTime"] = None
-            ts_json["lastTime"] = None
-            return TimeSeries(**ts_json)
+            self.create_timeseries(ts_name)
+            # create_timeseries invalidated the catalog, so this reloads it once
+            return self.edw_api.find_timeseries(ts_name)
 
 
 
@@ -167,7 +232,14 @@ class EndexDownloader:
         os.makedirs(DATA_FOLDER, exist_ok=True)
 
         local_pdf_file = os.path.join(DATA_FOLDER,"endex_data.pdf")
-        self.download_pdf(pdf_url, local_pdf_file)
+        state = self.load_state()
+        validators = self.download_pdf(pdf_url, local_pdf_file, state)
+        if validators is None:
+            print("Endex quotations unchanged, nothing to do.")
+            return
+        if validators is False:
+            print("Failed to download the PDF.")
+            return
 
         print(f"Extracting Endex 101 values from {local_pdf_file} as of {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
@@ -177,8 +249,18 @@ class EndexDownloader:
         if pdf_text:
             # Parse the values from the extracted text
             endex_df = self.parse_endex_values(pdf_text)
-            # Save it to the database
-            self.save_to_database(endex_df)
+            if endex_df.empty:
+                print("No Endex quotations found in the PDF.")
+                return
+            changed_df = self.changed_months(endex_df, state)
+            print(f"{len(changed_df)} of {len(endex_df)} months changed since the last parse")
+            # Save the changed months to the database
+            results = self.save_to_database(changed_df) if not changed_df.empty else []
+            # only remember the file once its values are stored, so a failed run is retried
+            if not all(r.ok for r in results):
+                print("Not all Endex quotations were stored, keeping the previous state so they are retried.")
+                return
+            self.save_state(dict(validators, months=self.month_values(endex_df)))
         else:
             print("Failed to extract text from the PDF.")
 
@@ -0,0 +1,113 @@
+import os
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+from backend.services.edw import EDWApi, TimeSeries, DataPointBatch, BatchResult
+
+FINGERPRINT_FOLDER = os.path.join("data", "fingerprints")  # Folder holding the fingerprint files
+
+
+def row_fingerprints(values: np.ndarray, decimals: int = 3) -> np.ndarray:
+    """One uint64 hash per row, after rounding to the stored DECIMAL scale so EDW round trips compare equal."""
+    return pd.util.hash_pandas_object(pd.DataFrame(np.round(values, decimals)), index=False).to_numpy()
+
+
+class FingerprintCache:
+    """
+    What EDW already holds, per series and UTC month, as sorted start times (epoch seconds) with a
+    fingerprint of the values stored at each time: <folder>/<tsid>/<YYYY-MM>.npz.
+    Months that were never seen are seeded once from EDW itself.
+    """
+
+    def __init__(self, edw_api: EDWApi, folder: str = None, decimals: int = 3, seed: bool = True):
+        self.edw_api = edw_api
+        self.folder = folder or os.getenv("FINGERPRINT_FOLDER", default=FINGERPRINT_FOLDER)
+        self.decimals = decimals
+        self.seed = seed
+        self._lock = threading.RLock()
+
+    def _path(self, ts_id: int, month: np.datetime64):
+        return os.path.join(self.folder, str(ts_id), f"{month}.npz")
+
+    def _save(self, ts_id: int, month: np.datetime64, times: np.ndarray, hashes: np.ndarray):
+        os.makedirs(os.path.join(self.folder, str(ts_id)), exist_ok=True)
+        np.savez(self._path(ts_id, month), times=times, hashes=hashes)
+
+    def known(self, ts: TimeSeries, month: np.datetime64) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            path = self._path(ts.id, month)
+            if os.path.exists(path):
+                with np.load(path) as data:
+                    return data["times"], data["hashes"]
+            times, hashes = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+            if self.seed and ts.lastTime is not None:
+                start = datetime.fromtimestamp(int(month.astype("datetime64[s]").astype(np.int64)), timezone.utc)
+                end = datetime.fromtimestamp(int((month + 1).astype("datetime64[s]").astype(np.int64)), timezone.utc)
+                times, values, _ = self.edw_api.get_datapoints_as_arrays(ts, start, end)
+                order = np.argsort(times)
+                times, hashes = times[order], row_fingerprints(values[order], self.decimals)
+            self._save(ts.id, month, times, hashes)
+            return times, hashes
+
+    def update(self, ts: TimeSeries, batch: DataPointBatch):
+        """Record rows that were written successfully."""
+        months = batch.times.astype("datetime64[s]").astype("datetime64[M]")
+        hashes = row_fingerprints(batch.values, self.decimals)
+        with self._lock:
+            for month in np.unique(months):
+                mask = months == month
+                times, known_hashes = self.known(ts, month)
+                times = np.concatenate([batch.times[mask], times])
+                known_hashes = np.concatenate([hashes[mask], known_hashes])
+                times, first = np.unique(times, return_index=True)  # new rows come first, so they win
+                self._save(ts.id, month, times, known_hashes[first])
+
+    def diff(self, ts: TimeSeries, batch: DataPointBatch) -> DataPointBatch:
+        """The rows of `batch` that are new or differ from what is stored."""
+        months = batch.times.astype("datetime64[s]").astype("datetime64[M]")
+        hashes = row_fingerprints(batch.values, self.decimals)
+        keep = np.ones(len(batch), dtype=bool)
+        for month in np.unique(months):
+            mask = months == month
+            times, known_hashes = self.known(ts, month)
+            if not len(times):
+                continue
+            pos = np.minimum(np.searchsorted(times, batch.times[mask]), len(times) - 1)
+            unchanged = (times[pos] == batch.times[mask]) & (known_hashes[pos] == hashes[mask])
+            keep[mask] = ~unchanged
+        return DataPointBatch(batch.times[keep], batch.values[keep], batch.fields)
+
+    def invalidate(self, ts_id: int, month: str = None):
+        """Forget a series ("YYYY-MM" month or all of it), e.g. after it was rewritten outside this process."""
+        with self._lock:
+            if month is None:
+                shutil.rmtree(os.path.join(self.folder, str(ts_id)), ignore_errors=True)
+            elif os.path.exists(self._path(ts_id, np.datetime64(month, "M"))):
+                os.remove(self._path(ts_id, np.datetime64(month, "M")))
+
+
+class ChangeOnlyWriter:
+    """
+    Diff-before-write front for EDWApi.store_datapoints: only new or changed points are posted,
+    and the fingerprints of successfully posted batches are recorded for the next run.
+    """
+
+    def __init__(self, edw_api: EDWApi, cache: FingerprintCache = None):
+        self.edw_api = edw_api
+        self.cache = cache or FingerprintCache(edw_api)
+
+    def store(self, ts: TimeSeries, batch: DataPointBatch) -> List[BatchResult]:
+        changed = self.cache.diff(ts, batch)
+        print(f"{ts.name}: {len(changed)} of {len(batch)} points new or changed")
+        if not len(changed):
+            return []
+        results = self.edw_api.store_datapoints(ts.id, changed)
+        batch_size = self.edw_api.batch_size
+        for result in results:
+            if result.ok:
+                self.cache.update(ts, changed.slice(result.index * batch_size, (result.index + 1) * batch_size))
+        return results
@@ -0,0 +1,49 @@
+import os
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+from backend.services.edw import EDWApi, TimeSeries
+
+
+def find_gaps(times: np.ndarray, fromdt: datetime, todt: datetime, period: timedelta = timedelta(minutes=15),
+              max_separation: timedelta = timedelta(0)) -> List[Tuple[datetime, datetime]]:
+    """
+    Compare stored start times (int64 epoch seconds) with the expected `period` grid over
+    [fromdt, todt) and return the missing intervals as half-open (start, end) UTC datetimes.
+    Gaps separated by at most `max_separation` of present data are merged into one interval,
+    which trades a few refetched points for fewer requests.
+    """
+    step = int(period.total_seconds())
+    first = -(-int(fromdt.timestamp()) // step) * step  # first grid point at or after fromdt
+    grid = np.arange(first, int(todt.timestamp()), step, dtype=np.int64)
+    missing = np.flatnonzero(~np.isin(grid, times))
+    if missing.size == 0:
+        return []
+    # a new interval starts wherever the next missing slot is more than max_separation further
+    breaks = np.flatnonzero(np.diff(missing) > 1 + int(max_separation.total_seconds()) // step)
+    starts = grid[missing[np.r_[0, breaks + 1]]]
+    ends = grid[missing[np.r_[breaks, missing.size - 1]]] + step
+    return [(datetime.fromtimestamp(int(s), timezone.utc), datetime.fromtimestamp(int(e), timezone.utc))
+            for s, e in zip(starts, ends)]
+
+
+class GapScanner:
+    """Finds the quarter-hours a series is missing over a lookback window, by reading its stored start times from EDW."""
+
+    def __init__(self, edw_api: EDWApi, period: timedelta = timedelta(minutes=15), max_separation: timedelta = None):
+        self.edw_api = edw_api
+        self.period = period
+        if max_separation is None:
+            max_separation = timedelta(minutes=int(os.getenv("GAP_MAX_SEPARATION_MINUTES", default="60")))
+        self.max_separation = max_separation
+
+    def scan(self, ts: TimeSeries, fromdt: datetime, todt: datetime) -> List[Tuple[datetime, datetime]]:
+        # only periods that have fully elapsed can be complete
+        step = self.period.total_seconds()
+        todt = datetime.fromtimestamp(todt.timestamp() // step * step, timezone.utc)
+        if ts.lastTime is None:
+            times = np.empty(0, dtype=np.int64)
+        else:
+            times, _, _ = self.edw_api.get_datapoints_as_arrays(ts, fromdt, todt)
+        return find_gaps(times, fromdt, todt, self.period, self.max_separation)
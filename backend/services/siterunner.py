@@ -0,0 +1,139 @@
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+from backend.services.checkpoint import CheckpointStore
+from backend.services.edw import split_range
+
+
+@dataclass
+class SiteResult:
+    site_id: str
+    rows: int = 0
+    fetch_seconds: float = 0.0
+    store_seconds: float = 0.0
+    error: str = None
+
+
+class SiteRunner:
+    """
+    Runs the ingestion of many sites concurrently as a two-stage pipeline: up to `workers` sites
+    are fetched at once, and every finished fetch is handed to the store stage right away, so
+    site N+1 is being fetched while site N is written to EDW. One failing site does not stop the others.
+
+    fetch(site_id) returns (ts, df); store(site_id, ts, df) writes it and returns its list of
+    BatchResult. A df of None is skipped; a site with failed batches gets an error and only the
+    rows of its successful batches are counted.
+    """
+
+    def __init__(self, workers: int = None, store_workers: int = None):
+        self.workers = workers or int(os.getenv("INGEST_WORKERS", default="4"))
+        self.store_workers = store_workers or int(os.getenv("INGEST_STORE_WORKERS", default="2"))
+
+    def run(self, site_ids: List[str], fetch: Callable, store: Callable) -> List[SiteResult]:
+        results = {site_id: SiteResult(site_id=site_id) for site_id in site_ids}
+
+        def timed_fetch(site_id):
+            start = time.perf_counter()
+            try:
+                return fetch(site_id)
+            finally:
+                results[site_id].fetch_seconds = time.perf_counter() - start
+
+        def timed_store(site_id, ts, df):
+            start = time.perf_counter()
+            try:
+                batches = store(site_id, ts, df) or []
+            finally:
+                results[site_id].store_seconds = time.perf_counter() - start
+            failed = [r for r in batches if not r.ok]
+            if failed:
+                results[site_id].error = f"{len(failed)} of {len(batches)} batches failed: {failed[0].error}"
+                results[site_id].rows = sum(r.rows for r in batches if r.ok)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as fetch_pool, \
+                ThreadPoolExecutor(max_workers=self.store_workers) as store_pool:
+            fetches = {fetch_pool.submit(timed_fetch, site_id): site_id for site_id in site_ids}
+            stores = {}
+            for future in as_completed(fetches):
+                site_id = fetches[future]
+                try:
+                    ts, df = future.result()
+                except Exception as e:
+                    traceback.print_exc()
+                    results[site_id].error = f"fetch failed: {e}"
+                    continue
+                if df is None:
+                    results[site_id].error = "no data fetched"
+                    continue
+                results[site_id].rows = len(df)
+                if len(df):
+                    stores[store_pool.submit(timed_store, site_id, ts, df)] = site_id
+            for future in as_completed(stores):
+                try:
+                    future.result()
+                except Exception as e:
+                    traceback.print_exc()
+                    results[stores[future]].error = f"store failed: {e}"
+
+        results = [results[site_id] for site_id in site_ids]
+        self.print_summary(results)
+        return results
+
+    def run_each(self, site_ids: List[str], task: Callable) -> List[SiteResult]:
+        """Run task(site_id) -> SiteResult for up to `workers` sites at once, e.g. a backfill per site."""
+        def safe_task(site_id):
+            try:
+                return task(site_id)
+            except Exception as e:
+                traceback.print_exc()
+                return SiteResult(site_id=site_id, error=str(e))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(safe_task, site_ids))
+        self.print_summary(results)
+        return results
+
+    @staticmethod
+    def backfill(site_id, fromutc: datetime, toutc: datetime, fetch: Callable, store: Callable,
+                 checkpoints: CheckpointStore, window: timedelta = None) -> SiteResult:
+        """
+        Ingest [fromutc, toutc) for one site in fixed windows: fetch(site_id, start, end) -> df,
+        store(df) -> list of BatchResult. Every stored window is checkpointed, so a rerun after a
+        crash resumes after the last finished window; memory stays bounded by one window.
+        The checkpoint is cleared once the whole range is stored.
+        """
+        window = window or timedelta(hours=int(os.getenv("BACKFILL_WINDOW_HOURS", default="24")))
+        result = SiteResult(site_id=site_id)
+        checkpoint = checkpoints.get(site_id)
+        if checkpoint is not None and fromutc < checkpoint < toutc:
+            print(f"Resuming site {site_id} from checkpoint {checkpoint}")
+            fromutc = checkpoint
+        for start, end in split_range(fromutc, toutc, window):
+            started = time.perf_counter()
+            df = fetch(site_id, start, end)
+            result.fetch_seconds += time.perf_counter() - started
+            if df is None:
+                result.error = f"fetch failed for window {start} - {end}"
+                return result
+            if len(df):
+                started = time.perf_counter()
+                failed = [r for r in store(df) or [] if not r.ok]
+                result.store_seconds += time.perf_counter() - started
+                if failed:
+                    result.error = f"{len(failed)} batches failed for window {start} - {end}"
+                    return result
+            result.rows += len(df)
+            checkpoints.set(site_id, end)
+        checkpoints.clear(site_id)
+        return result
+
+    @staticmethod
+    def print_summary(results: List[SiteResult]):
+        print(f"{'site':<12}{'rows':>8}{'fetch (s)':>12}{'store (s)':>12}  status")
+        for r in results:
+            print(f"{r.site_id:<12}{r.rows:>8}{r.fetch_seconds:>12.2f}{r.store_seconds:>12.2f}  {r.error or 'ok'}")
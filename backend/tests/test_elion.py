@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from backend.services.elion import Elion
+
+RESPONSES = {
+    "/box_data/grid_metering_box": {"GRID_DATA": [
+        {"UTCTIME": "2025-01-01 00:00", "GRID": 1.0},
+        {"UTCTIME": "2025-01-01 00:05", "GRID": 2.0},
+        {"UTCTIME": "2025-01-01 00:05", "GRID": 3.0},  # repeated timestamp
+    ]},
+    "/box_data/total_consumption": {"CONSUMPTION_DATA": [
+        {"UTCTIME": "2025-01-01 00:00", "CONSUMPTION": 4.0, "CONSUMPTION_CUMULATIVE": 40.0},
+        {"UTCTIME": "2025-01-01 00:05", "CONSUMPTION": 5.0, "CONSUMPTION_CUMULATIVE": 45.0},
+    ]},
+    "/box_data/total_production": {"PRODUCTION_DATA": [
+        {"UTCTIME": "2025-01-01 00:00", "PRODUCTION": 6.0, "PRODUCTION_CUMULATIVE": 60.0},
+        {"UTCTIME": "2025-01-01 00:05", "PRODUCTION": 7.0, "PRODUCTION_CUMULATIVE": 67.0},
+    ]},
+    "/box_data/curtailed_production": {"PRODUCTION_DATA": [
+        {"UTCTIME": "2025-01-01 00:00", "PRODUCTION": 0.0, "PRODUCTION_CUMULATIVE": 0.0},
+        {"UTCTIME": "2025-01-01 00:05", "PRODUCTION": 0.5, "PRODUCTION_CUMULATIVE": 0.5},
+    ]},
+    "/box_data/uncurtailed_production": {"PRODUCTION_DATA": [
+        {"UTCTIME": "2025-01-01 00:00", "PRODUCTION": 6.0, "PRODUCTION_CUMULATIVE": 60.0},
+        {"UTCTIME": "2025-01-01 00:05", "PRODUCTION": 7.5, "PRODUCTION_CUMULATIVE": 67.5},
+    ]},
+    "/box_data/charge_discharge": {"FLEX_DATA": [
+        {"UTCTIME": "2025-01-01 00:00", "FLEX_CHARGE": 1.0, "FLEX_DISCHARGE": 0.0},
+        {"UTCTIME": "2025-01-01 00:05", "FLEX_CHARGE": 0.0, "FLEX_DISCHARGE": 2.0},
+    ]},
+}
+
+
+def _elion():
+    # get_site_data only needs the endpoint responses, no login, EDW or HTTP session
+    elion = Elion.__new__(Elion)
+    elion.token = None
+    elion.get_data = lambda token, method, params: RESPONSES[method]
+    elion._get_soc_data = lambda site_id, params: None
+    return elion
+
+
+def test_get_site_data_with_duplicated_timestamp():
+    df = _elion().get_site_data(341, datetime(2025, 1, 1), datetime(2025, 1, 1, 0, 15))
+
+    assert len(df) == 1
+    row = df.iloc[0]
+    assert row["GRID"] == 1.0 + 3.0  # the repeated 00:05 keeps its last value
+    assert row["CONSUMPTION"] == 9.0
+    assert row["CURTAILED_PRODUCTION"] == 0.5
+    assert row["FLEX_DISCHARGE"] == 2.0
+    assert row["SOC"] == 0.0
@@ -0,0 +1,26 @@
+from backend.services.endex import EndexDownloader
+
+
+def _downloader():
+    # changed_months and parse_endex_values need neither the database nor EDW
+    return EndexDownloader.__new__(EndexDownloader)
+
+
+def test_changed_months_with_duplicated_month():
+    downloader = _downloader()
+    df = downloader.parse_endex_values("01/2024 80,10 81,20\n02/2024 70,00 71,00\n01/2024 82,30 83,40\n")
+    state = {"months": {"2024-02": [70.0, 71.0]}}
+
+    changed = downloader.changed_months(df, state)
+
+    assert list(changed["Month"].dt.strftime("%Y-%m")) == ["2024-01"]
+    assert changed["Endex101"].tolist() == [82.3]
+    assert changed["Endex103"].tolist() == [83.4]
+
+
+def test_changed_months_unchanged_duplicate():
+    downloader = _downloader()
+    df = downloader.parse_endex_values("01/2024 80,10 81,20\n01/2024 80,10 81,20\n")
+    state = {"months": downloader.month_values(df)}
+
+    assert downloader.changed_months(df, state).empty